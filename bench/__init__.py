@@ -0,0 +1 @@
+# benchmarks, run with: uv run python -m bench.<name>
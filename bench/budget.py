@@ -0,0 +1,110 @@
+"""History sent with each prompt: the latest 10 items vs. a token budget, with
+and without pruning tool calls, and the queries needed for each
+
+Conversations are made of the turns in `bench.history` and written to the
+DynamoDB stand-in of `bench.dynamo`, or to `--url`. Tokens are estimated the
+same way the budget is, about 4 characters each.
+
+    uv run python -m bench.budget --tokens 4000
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import os
+
+from pydantic_ai.messages import ModelMessage
+
+import wa.dynamo as db
+import wa.metrics as metrics
+from wa.dynamo import messages
+
+from .dynamo import TABLES, serve
+from .history import chat, tools
+
+CONVERSATIONS = {
+    "chat": [chat() for _ in range(30)],
+    "tools": [tools() if i % 2 else chat() for i in range(30)],
+    "tool-heavy": [tools(calls=16) for _ in range(30)],
+}
+
+
+def queries() -> int:
+    for i in metrics.registry.dump():
+        if i["name"] == "dynamo.latency" and i["labels"] == {"op": "Query"}:
+            return i["count"]
+    return 0
+
+
+async def record(sender: str, turns: list[list[ModelMessage]]):
+    start = dt.datetime(2025, 1, 1, tzinfo=dt.UTC)
+    for n, turn in enumerate(turns):
+        timestamp = start + dt.timedelta(minutes=n)
+        item = db.MessageText(from_=sender, timestamp=timestamp, data={})
+        item.model_messages = turn
+        await item.asave()
+
+
+async def measure(sender: str, tokens: int) -> dict[str, tuple[int, int, int]]:
+    """Estimated tokens, messages and queries of each loader"""
+    item = db.MessageText(from_=sender)
+    loaders = {
+        "latest 10": lambda: item.alatest(limit=10),
+        "budget": lambda: item.arecent(tokens, prune=False),
+        "budget+prune": lambda: item.arecent(tokens, prune=True),
+    }
+    results = {}
+    for name, load in loaders.items():
+        before = queries()
+        history = await load()
+        used = messages._tokens(history)
+        results[name] = (used, len(history), queries() - before)
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="DynamoDB endpoint with the tables created")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--tokens", type=int, default=4000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    process = None
+    url = args.url
+    if url is None:
+        process = await serve(args.port, 0)
+        url = f"http://127.0.0.1:{args.port}"
+
+    for cls, table in zip((db.Message, db.WhatsAppItem, db.Tool), TABLES):
+        cls.Meta.table_name = table
+    # queries are counted by the native client's metrics
+    db.aio.init(url, native=True)
+    # every load goes to the table
+    messages.cache(size=0, capacity=0, ttl=0)
+
+    header = ("conversation", "loader", "tokens", "vs 10", "messages", "queries")
+    print("{:<12} {:<13} {:>7} {:>6} {:>9} {:>8}".format(*header))
+    try:
+        for name, turns in CONVERSATIONS.items():
+            await record(f"bench-{name}", turns)
+            results = await measure(f"bench-{name}", args.tokens)
+            baseline, *_ = results["latest 10"]
+            for loader, (used, sent, count) in results.items():
+                ratio = f"{used / baseline:.0%}"
+                print(
+                    f"{name:<12} {loader:<13} {used:>7,} {ratio:>6} "
+                    f"{sent:>9} {count:>8}"
+                )
+    finally:
+        await db.aio.aclose()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
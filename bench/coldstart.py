@@ -0,0 +1,157 @@
+"""Cold start of the Lambda handler with and without `WARM_UP`: init time, the
+first webhook, a status, and the first call of each client, each run in a new
+process
+
+Imports `handler.py`, so init is exactly the Lambda one. The Graph API is the
+stand-in of `bench.graph`, which also answers the LLM's `GET /models`, DynamoDB
+and S3 the stand-in of `bench.dynamo`. Both add `--latency` to every response.
+They are plain HTTP, the TLS handshakes saved in AWS are not included.
+
+    uv run python -m bench.coldstart
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .dynamo import serve
+from .payloads import status, webhook
+
+SECRET = "bench-app-secret"
+
+ENV = {
+    "WHATSAPP_VERIFY_TOKEN": "bench",
+    "WHATSAPP_ACCESS_TOKEN": "bench",
+    "WHATSAPP_SENDER_ID": "123456789012345",
+    "WHATSAPP_SENDER_NUMBER": "15550000000",
+    "WHATSAPP_APP_SECRET": SECRET,
+    "OPENAI_API_KEY": "bench",
+    "HELICONE_API_KEY": "bench",
+    "GEMINI_API_KEY": "",
+    "DYNAMO_DB_TABLE_MESSAGES": "MESSAGES_TABLE",
+    "DYNAMO_DB_TABLE_EVENTS": "EVENTS_TABLE",
+    "DYNAMO_DB_TABLE_TOOLS": "TOOLS_TABLE",
+    "AWS_S3_BUCKET_RAG": "bench-bucket",
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+RUNS = 5
+
+
+def child():
+    """Prints the seconds spent in init, the first webhook and the first call
+    of each client"""
+    start = time.perf_counter()
+    import handler
+    import wa.warm
+
+    took = {"init": time.perf_counter() - start}
+
+    app, loop = handler.app, handler.loop
+    res = app.state.resources
+    body = json.dumps(webhook(statuses=[status()])).encode()
+    signature = hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+    headers = {"x-hub-signature-256": f"sha256={signature}"}
+
+    async def first():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://wa") as c:
+            start = time.perf_counter()
+            response = await c.post("/", content=body, headers=headers)
+            await res.writer.flush()
+            took["webhook"] = time.perf_counter() - start
+        assert response.is_success, response.text
+
+        for name, fn in wa.warm.TARGETS.items():
+            start = time.perf_counter()
+            try:
+                await fn(res)
+            except Exception as e:
+                print(f"{name}: {e}", file=sys.stderr)
+            took[name] = time.perf_counter() - start
+
+    loop.run_until_complete(first())
+    print(json.dumps(took))
+    os._exit(0)
+
+
+async def _graph(port: int, latency: float) -> subprocess.Popen:
+    env = {**os.environ, "GRAPH_LATENCY": str(latency)}
+    cmd = [sys.executable, "-m", "uvicorn", "bench.graph:create", "--factory"]
+    cmd += ["--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(cmd, env=env)
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/")
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Graph API stand-in did not start")
+
+
+def _targets() -> list[str]:
+    # imported here, so the children measure importing `wa` cold
+    import wa.warm
+
+    return list(wa.warm.TARGETS)
+
+
+def run(warm: bool, env: dict[str, str]) -> dict[str, float]:
+    env = {**os.environ, **ENV, **env, "WARM_UP": str(warm).lower()}
+    result = subprocess.run(
+        [sys.executable, "-m", "bench.coldstart", "--child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    *_, line = result.stdout.strip().splitlines()
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    graph_port = args.port + 1
+    dynamo = asyncio.run(serve(args.port, args.latency))
+    graph = asyncio.run(_graph(graph_port, args.latency))
+    env = {
+        "AWS_ENDPOINT_URL": f"http://127.0.0.1:{args.port}",
+        "WHATSAPP_BASE_URL": f"http://127.0.0.1:{graph_port}/v22.0",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{graph_port}/v1",
+    }
+
+    columns = ["init", "webhook", *_targets()]
+    print(f"{'WARM_UP':<8}" + "".join(f"{i + ' ms':>12}" for i in columns))
+    try:
+        for warm in (False, True):
+            runs = [run(warm, env) for _ in range(RUNS)]
+            row = [statistics.median(i[c] for i in runs) * 1000 for c in columns]
+            print(f"{str(warm).lower():<8}" + "".join(f"{i:>12.0f}" for i in row))
+    finally:
+        for process in (dynamo, graph):
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""DynamoDB throughput and memory, PynamoDB in the default executor vs. in the
+`dynamo` executor (the default client) vs. the native asyncio client
+(`DYNAMO_DB_NATIVE`), at 10, 100 and 1000 concurrent operations
+
+Starts an in-memory DynamoDB stand-in in another process unless `--url` points
+to a real one (e.g. localstack on http://localhost:4566, with the tables created)
+
+    uv run python -m bench.dynamo --latency 0.01
+    uv run python -m bench.dynamo --url http://localhost:4566
+
+With `--rcu`, reports the capacity and bytes of history reads instead. The
+stand-in bills queries like DynamoDB, on the whole items read
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import math
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+import wa.dynamo as db
+import wa.metrics as metrics
+import wa.whats.models as models
+from wa.dynamo import messages
+
+from . import history, payloads
+from .history import size
+
+TABLES = {
+    "MESSAGES_TABLE": ("from_", "timestamp"),
+    "EVENTS_TABLE": ("id", "key"),
+    "TOOLS_TABLE": ("id", "tool"),
+}
+
+
+def standin() -> FastAPI:
+    """Just enough of DynamoDB for the models: items are kept in memory and
+    filter expressions are ignored. Run with `uvicorn --factory`"""
+    latency = float(os.environ.get("DYNAMO_LATENCY", 0))
+    app = FastAPI()
+    tables: dict[str, dict[tuple, dict]] = defaultdict(dict)
+
+    def key(table: str, item: dict) -> tuple:
+        hk, rk = TABLES[table]
+        return (str(item[hk]), str(item.get(rk)))
+
+    def error(code: str) -> JSONResponse:
+        body = {"__type": f"com.amazonaws.dynamodb.v20120810#{code}", "message": code}
+        return JSONResponse(body, status_code=400)
+
+    def project(item: dict, body: dict) -> dict:
+        if "ProjectionExpression" not in body:
+            return item
+        names = body.get("ExpressionAttributeNames", {})
+        paths = [i.strip() for i in body["ProjectionExpression"].split(",")]
+        keep = {names.get(i, i) for i in paths}
+        return {k: v for k, v in item.items() if k in keep}
+
+    capacity = {"CapacityUnits": 1.0}
+
+    @app.post("/")
+    async def dispatch(request: Request):
+        await asyncio.sleep(latency)
+        *_, op = request.headers["x-amz-target"].split(".")
+        body = await request.json()
+        table = body.get("TableName", "")
+
+        if op == "DescribeTable":
+            hk, rk = TABLES[table]
+            return {
+                "Table": {
+                    "TableName": table,
+                    "TableStatus": "ACTIVE",
+                    "KeySchema": [
+                        {"AttributeName": hk, "KeyType": "HASH"},
+                        {"AttributeName": rk, "KeyType": "RANGE"},
+                    ],
+                    "AttributeDefinitions": [
+                        {"AttributeName": hk, "AttributeType": "S"},
+                        {"AttributeName": rk, "AttributeType": "S"},
+                    ],
+                }
+            }
+        if op == "PutItem":
+            k = key(table, body["Item"])
+            condition = body.get("ConditionExpression", "")
+            if "attribute_not_exists" in condition and k in tables[table]:
+                return error("ConditionalCheckFailedException")
+            tables[table][k] = body["Item"]
+            return {"ConsumedCapacity": {"TableName": table, **capacity}}
+        if op == "GetItem":
+            item = tables[table].get(key(table, body["Key"]))
+            response = {"ConsumedCapacity": {"TableName": table, **capacity}}
+            return {"Item": item, **response} if item else response
+        if op == "Query":
+            # `#0 = :0`, the hash key only
+            (placeholder,) = re.findall(r":\w+", body["KeyConditionExpression"])
+            hk = body["ExpressionAttributeValues"][placeholder]
+            found = sorted(i for i in tables[table].items() if i[0][0] == str(hk))
+            if not body.get("ScanIndexForward", True):
+                found.reverse()
+            if "ExclusiveStartKey" in body:
+                start = key(table, body["ExclusiveStartKey"])
+                found = found[[k for k, _ in found].index(start) + 1 :]
+
+            limit = body.get("Limit", len(found))
+            items = [v for _, v in found[:limit]]
+            # billed on the whole items read, before any projection: 0.5 per
+            # 4KB for eventually consistent reads
+            read = sum(size({"M": i}) for i in items)
+            units = max(math.ceil(read / 4096), 1) * 0.5
+            response = {
+                "Items": [project(i, body) for i in items],
+                "Count": len(items),
+                "ScannedCount": len(items),
+                "ConsumedCapacity": {"TableName": table, "CapacityUnits": units},
+            }
+            if len(found) > limit:
+                names = TABLES[table]
+                response["LastEvaluatedKey"] = {i: items[-1][i] for i in names}
+            return response
+        if op == "DeleteItem":
+            tables[table].pop(key(table, body["Key"]), None)
+            return {"ConsumedCapacity": {"TableName": table, **capacity}}
+        if op == "BatchWriteItem":
+            for name, requests in body["RequestItems"].items():
+                for i in requests:
+                    item = i["PutRequest"]["Item"]
+                    tables[name][key(name, item)] = item
+            return {"UnprocessedItems": {}, "ConsumedCapacity": []}
+        return error("UnknownOperationException")
+
+    return app
+
+
+def model(i: int) -> db.MessageText:
+    data = {"text": {"body": f"message {i}"}}
+    return db.MessageText(from_=f"user-{i % 50}", data=data, agent={"messages": []})
+
+
+async def executor(i: int):
+    loop = asyncio.get_event_loop()
+    item = model(i)
+    await loop.run_in_executor(None, item.save)
+    await loop.run_in_executor(None, db.ToolTodo.fetch, f"user-{i % 50}")
+
+
+async def client(i: int):
+    item = model(i)
+    await item.asave()
+    await db.ToolTodo.afetch(f"user-{i % 50}")
+
+
+async def run(fn, concurrency: int, total: int) -> tuple[float, int]:
+    """Returns ops/s and peak threads"""
+    semaphore = asyncio.Semaphore(concurrency)
+    threads = threading.active_count()
+
+    async def one(i: int):
+        nonlocal threads
+        async with semaphore:
+            await fn(i)
+            threads = max(threads, threading.active_count())
+
+    start = time.perf_counter()
+    async with asyncio.TaskGroup() as tg:
+        for i in range(total):
+            tg.create_task(one(i))
+    elapsed = time.perf_counter() - start
+
+    # every operation is a put and a get
+    return 2 * total / elapsed, threads
+
+
+async def memory(fn, concurrency: int) -> float:
+    """Peak MiB traced while `concurrency` operations are in flight"""
+    tracemalloc.start()
+    async with asyncio.TaskGroup() as tg:
+        for i in range(concurrency):
+            tg.create_task(fn(i))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+async def rcu(turns: int, tokens: int):
+    """Capacity and bytes read by one history load, whole items as before vs.
+    projected, for 30 turns stored in each format"""
+    received = 0
+
+    async def count(response: httpx.Response):
+        nonlocal received
+        received += int(response.headers.get("content-length", 0))
+
+    db.aio.client().client.event_hooks["response"].append(count)
+    messages.cache(size=0, capacity=0, ttl=0)
+
+    async def whole(item: db.Message):
+        query = db.aio.client().query(
+            type(item), item.from_, limit=10, scan_index_forward=False
+        )
+        return [j async for i in query for j in i.model_messages]
+
+    loaders = {
+        "whole items": whole,
+        "projected": lambda i: i.alatest(limit=10),
+        "budget": lambda i: i.arecent(tokens),
+    }
+
+    header = ("format", "loader", "RCU", "KiB read")
+    print("{:<7} {:<12} {:>6} {:>9}".format(*header))
+    for format in ("map", "binary"):
+        messages.encoding(format)  # type: ignore
+        sender = f"rcu-{format}"
+        start = dt.datetime(2025, 1, 1, tzinfo=dt.UTC)
+        for n in range(turns):
+            data = models.MessageObjectAdapter.validate_python(payloads.text(n))
+            item = db.MessageText.from_model(data)
+            item.from_ = sender
+            item.timestamp = start + dt.timedelta(minutes=n)
+            item.model_messages = history.tools() if n % 3 == 0 else history.chat()
+            await item.asave()
+
+        for name, load in loaders.items():
+            before = capacity("Query"), received
+            await load(db.MessageText(from_=sender))
+            units, read = capacity("Query") - before[0], received - before[1]
+            print(f"{format:<7} {name:<12} {units:>6.1f} {read / 1024:>9.1f}")
+
+
+def capacity(op: str) -> float:
+    for i in metrics.registry.dump():
+        if i["name"] == "dynamo.capacity" and i["labels"] == {"op": op}:
+            return i["sum"]
+    return 0
+
+
+async def serve(port: int, latency: float) -> subprocess.Popen:
+    env = {**os.environ, "DYNAMO_LATENCY": str(latency)}
+    cmd = [sys.executable, "-m", "uvicorn", "bench.dynamo:standin", "--factory"]
+    cmd += ["--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(cmd, env=env)
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/")
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError("DynamoDB stand-in did not start")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="DynamoDB endpoint with the tables created")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--total", type=int, default=2000)
+    parser.add_argument("--rcu", action="store_true", help="history reads instead")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    process = None
+    url = args.url
+    if url is None:
+        process = await serve(args.port, args.latency)
+        url = f"http://127.0.0.1:{args.port}"
+
+    for cls, table in zip((db.Message, db.WhatsAppItem, db.Tool), TABLES):
+        cls.Meta.table_name = table
+        cls.Meta.host = url
+        cls.Meta.max_pool_connections = 50
+    db.aio.init(url, max_connections=50, native=True)
+
+    header = ("concurrency", "mode", "ops/s", "peak MiB", "threads")
+    try:
+        if args.rcu:
+            await rcu(turns=30, tokens=4000)
+            return
+
+        print("{:>11} {:<9} {:>8} {:>9} {:>8}".format(*header))
+        modes = (("executor", executor), ("threaded", client), ("native", client))
+        for concurrency in (10, 100, 1000):
+            for name, fn in modes:
+                await db.aio.aclose()
+                db.aio.init(url, max_connections=50, native=name == "native")
+                ops, threads = await run(fn, concurrency, args.total)
+                peak = await memory(fn, concurrency)
+                print(
+                    f"{concurrency:>11} {name:<9} {ops:>8.0f} {peak:>9.1f} {threads:>8}"
+                )
+    finally:
+        await db.aio.aclose()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""Stand-in for the Graph API endpoints used by `WhatsApp`: messages, media
+lookup and media download, with injected latency, errors and throttling
+
+    GRAPH_LATENCY=0.1 GRAPH_THROTTLE=0.05 \\
+        uv run uvicorn bench.graph:create --factory --port 8081
+    WHATSAPP_BASE_URL=http://localhost:8081/v22.0 uv run uvicorn ...
+
+Settings, from the environment:
+- `GRAPH_LATENCY`: seconds added to every response, on average
+- `GRAPH_JITTER`: maximum random seconds added on top of the latency
+- `GRAPH_ERRORS`: fraction of requests failing with 500
+- `GRAPH_THROTTLE`: fraction of requests failing with 429
+- `GRAPH_MEDIA_SIZE`: bytes of every media download
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+BLOCK = 64 * 1024
+
+
+@dataclass
+class Faults:
+    latency: float = 0
+    jitter: float = 0
+    errors: float = 0
+    throttle: float = 0
+    media_size: int = 1024 * 1024
+    block: bytes = field(default_factory=lambda: os.urandom(BLOCK), repr=False)
+
+    @staticmethod
+    def from_env() -> "Faults":
+        return Faults(
+            latency=float(os.environ.get("GRAPH_LATENCY", 0)),
+            jitter=float(os.environ.get("GRAPH_JITTER", 0)),
+            errors=float(os.environ.get("GRAPH_ERRORS", 0)),
+            throttle=float(os.environ.get("GRAPH_THROTTLE", 0)),
+            media_size=int(os.environ.get("GRAPH_MEDIA_SIZE", 1024 * 1024)),
+        )
+
+    def media(self):
+        full, rest = divmod(self.media_size, BLOCK)
+        for _ in range(full):
+            yield self.block
+        if rest:
+            yield self.block[:rest]
+
+    def sha256(self) -> str:
+        sha256 = hashlib.sha256()
+        for chunk in self.media():
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+def _error(status: int, code: int, message: str, **headers: str) -> Response:
+    body = {"error": {"message": message, "type": "OAuthException", "code": code}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def create(faults: Faults | None = None) -> FastAPI:
+    faults = faults or Faults.from_env()
+    sha256 = faults.sha256()
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def inject(request: Request, call_next):
+        await asyncio.sleep(faults.latency + random.uniform(0, faults.jitter))
+
+        roll = random.random()
+        if roll < faults.throttle:
+            usage = (
+                '{"0": [{"type": "whatsapp", "estimated_time_to_regain_access": 0}]}'
+            )
+            return _error(
+                429,
+                130429,
+                "Rate limit hit",
+                **{"Retry-After": "1", "X-Business-Use-Case-Usage": usage},
+            )
+        if roll < faults.throttle + faults.errors:
+            return _error(500, 131000, "Something went wrong")
+        return await call_next(request)
+
+    # before the lookup, both have two path segments
+    @app.get("/download/{media_id}")
+    async def download(media_id: str):
+        return StreamingResponse(faults.media(), media_type="image/jpeg")
+
+    @app.get("/{version}/{media_id}")
+    async def lookup(request: Request, version: str, media_id: str):
+        expires = int(time.time()) + 300
+        return {
+            "messaging_product": "whatsapp",
+            "id": media_id,
+            "url": f"{request.base_url}download/{media_id}?ext={expires}",
+            "mime_type": "image/jpeg",
+            "sha256": sha256,
+            "file_size": faults.media_size,
+        }
+
+    @app.post("/{version}/{sender_id}/messages")
+    async def messages(request: Request, version: str, sender_id: str):
+        body = await request.json()
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": body["to"], "wa_id": body["to"]}],
+            "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}],
+        }
+
+    return app
@@ -0,0 +1,120 @@
+"""Agent history stored as a DynamoDB map vs. compressed binary: encode and
+decode time and item size, for a chat turn and a tool-heavy one
+
+Encoding covers setting `model_messages` and serializing the item for the
+DynamoDB API, decoding the reverse. Sizes are counted as DynamoDB bills them.
+
+    uv run python -m bench.history
+    uv run --extra zstd python -m bench.history
+"""
+
+import base64
+import json
+import timeit
+from typing import Any
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from pynamodb._util import bin_encode_attr
+
+import wa.dynamo as db
+from wa.dynamo import messages
+
+
+def chat() -> list[ModelMessage]:
+    return [
+        ModelRequest(
+            parts=[
+                SystemPromptPart(content="You are a helpful assistant. " * 10),
+                UserPromptPart(content="What should I cook tonight?"),
+            ]
+        ),
+        ModelResponse(parts=[TextPart(content="How about a mushroom risotto? " * 8)]),
+    ]
+
+
+def tools(calls: int = 8) -> list[ModelMessage]:
+    todos = [{"id": i, "text": f"buy item {i}", "done": i % 2 == 0} for i in range(40)]
+    turn: list[ModelMessage] = [
+        ModelRequest(parts=[UserPromptPart(content="Sort out my todo list")])
+    ]
+    for i in range(calls):
+        call = ToolCallPart(
+            tool_name="todo_list",
+            args={"filter": "all", "page": i},
+            tool_call_id=f"call_{i}",
+        )
+        turn.append(ModelResponse(parts=[call]))
+        result = ToolReturnPart(
+            tool_name="todo_list", content=todos, tool_call_id=f"call_{i}"
+        )
+        turn.append(ModelRequest(parts=[result]))
+    turn.append(ModelResponse(parts=[TextPart(content="Done, 20 items left.")]))
+    return turn
+
+
+def size(value: dict[str, Any]) -> int:
+    """Bytes of a serialized attribute value, as DynamoDB counts them"""
+    (kind, data), *_ = value.items()
+    if kind in ("S", "N"):
+        return len(str(data).encode())
+    if kind == "B":
+        # base64 in the DynamoDB JSON API
+        return len(base64.b64decode(data)) if isinstance(data, str) else len(data)
+    if kind in ("BOOL", "NULL"):
+        return 1
+    if kind == "L":
+        return 3 + sum(1 + size(i) for i in data)
+    if kind == "M":
+        return 3 + sum(1 + len(k.encode()) + size(v) for k, v in data.items())
+    raise ValueError(kind)
+
+
+def encode(turn: list[ModelMessage]) -> bytes:
+    item = db.MessageText(from_="5511999999999", data={"text": {"body": "hi"}})
+    item.model_messages = turn
+    attributes = item.serialize()
+    for i in attributes.values():
+        bin_encode_attr(i)
+    return json.dumps({"Item": attributes}).encode()
+
+
+def decode(body: bytes) -> list[ModelMessage]:
+    item = db.aio._load(db.Message, json.loads(body)["Item"])
+    return item.model_messages
+
+
+def measure(turn: list[ModelMessage], number: int = 200) -> tuple[float, float, int]:
+    """Microseconds to encode and decode, and item bytes"""
+    body = encode(turn)
+    encoding = min(timeit.repeat(lambda: encode(turn), number=number, repeat=5))
+    decoding = min(timeit.repeat(lambda: decode(body), number=number, repeat=5))
+
+    item = db.MessageText(from_="5511999999999", data={"text": {"body": "hi"}})
+    item.model_messages = turn
+    total = sum(len(k) + size(v) for k, v in item.serialize().items())
+    return encoding / number * 1e6, decoding / number * 1e6, total
+
+
+def main():
+    codec = "zstd" if messages._zstd() is not None else "zlib"
+    header = ("turn", "format", "encode us", "decode us", "item bytes")
+    print("{:<6} {:<12} {:>10} {:>10} {:>11}".format(*header))
+    for name, turn in (("chat", chat()), ("tools", tools())):
+        for format in ("map", "binary"):
+            messages.encoding(format)  # type: ignore
+            enc, dec, total = measure(turn)
+            label = f"binary/{codec}" if format == "binary" else format
+            print(f"{name:<6} {label:<12} {enc:>10.0f} {dec:>10.0f} {total:>11,}")
+
+
+if __name__ == "__main__":
+    main()
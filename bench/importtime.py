@@ -0,0 +1,76 @@
+"""Import time of the Lambda init path, checked against a per-module budget
+
+    make importtime
+
+Runs `python -X importtime` on the modules `handler.py` imports during init and
+exits with an error when a module goes over its budget, or when importing them
+pulls in a module of `LAZY`. Only the imports are checked, not the lifespan.
+"""
+
+import subprocess
+import sys
+
+TARGET = "import mangum, wa.app, wa.lifespan, wa.routes"
+
+BUDGET = {
+    "mangum": 80_000,
+    "wa.app": 450_000,
+    "wa.lifespan": 400_000,
+    "wa.dynamo": 350_000,
+    "wa.resources": 30_000,
+    "wa.routes": 30_000,
+}
+"""Cumulative import time in microseconds. Shared dependencies are charged to
+the first module importing them, so keep the import order of `TARGET`. About
+1.3 times the fastest of 5 runs, measured with `make importtime` on 1 CPU:
+mangum 57-64 ms, wa.app 349-398, wa.lifespan 297-331, wa.dynamo 255-288,
+wa.resources 14-16 and wa.routes 11-15"""
+
+LAZY = ["pydantic_ai", "openai", "boto3", "types_boto3_s3", "wa.agents"]
+"""Modules importing the app must not pull in. Starting it may still import
+them: `WEBHOOK_QUEUE=sqs` imports boto3 to create the SQS client, and `WARM_UP`
+builds every client during the Lambda init, see `handler.py`"""
+
+RUNS = 5
+
+
+def measure() -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TARGET],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def main() -> int:
+    runs = [measure() for _ in range(RUNS)]
+    # the fastest run is the least noisy one
+    times = {k: min(i.get(k, 0) for i in runs) for k in runs[0]}
+
+    failed = False
+    print(f"{'module':<16} {'import (ms)':>12} {'budget (ms)':>12}")
+    for module, budget in BUDGET.items():
+        took = times.get(module, 0)
+        status = "ok" if took <= budget else "OVER"
+        failed |= took > budget
+        print(f"{module:<16} {took / 1000:>12.1f} {budget / 1000:>12.1f}  {status}")
+
+    for module in LAZY:
+        if module in times:
+            failed = True
+            print(f"{module} is imported by the app, it must be imported lazily")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Drives `WhatsApp.send`, `reply` and `media` at a target rate and reports
+latency percentiles. Starts `bench.graph` in-process unless `--url` is given.
+The in-process server shares the event loop with the client, run it on its own
+for rates above a few hundred requests per second
+
+    uv run python -m bench.load --rps 200 --duration 10 --latency 0.05
+    uv run python -m bench.load --url http://localhost:8081/v22.0
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections import defaultdict
+
+import uvicorn
+
+import wa.metrics as metrics
+from wa.whats.client import Transport, WhatsApp
+
+from .graph import Faults, create
+
+OPS = ("send", "reply", "media")
+
+
+async def media(whats: WhatsApp, i: int):
+    # a new id every time, otherwise the lookup is cached
+    async with whats.stream(f"media-{i}") as response:
+        async for _ in response.aiter_bytes():
+            pass
+
+
+async def drive(whats: WhatsApp, ops: list[str], rps: float, duration: float):
+    took: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+
+    async def one(op: str, i: int):
+        start = time.perf_counter()
+        try:
+            if op == "send":
+                await whats.send("5511999999999", f"load {i}")
+            elif op == "reply":
+                await whats.reply("5511999999999", f"wamid.{i}", f"load {i}")
+            else:
+                await media(whats, i)
+        except Exception:
+            errors[op] += 1
+            return
+        took[op].append(time.perf_counter() - start)
+
+    # open loop: requests start on schedule, however slow the previous ones are
+    total = int(rps * duration)
+    start = time.perf_counter()
+    async with asyncio.TaskGroup() as tg:
+        for i in range(total):
+            delay = start + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tg.create_task(one(ops[i % len(ops)], i))
+    elapsed = time.perf_counter() - start
+
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.0f} req/s")
+    print(
+        f"{'op':<6} {'ok':>6} {'errors':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}"
+    )
+    for op in ops:
+        samples = took[op] or [0.0]
+        if len(samples) > 1:
+            q = statistics.quantiles(samples, n=100, method="inclusive")
+            p50, p90, p99 = q[49], q[89], q[98]
+        else:
+            p50 = p90 = p99 = samples[0]
+        print(
+            f"{op:<6} {len(took[op]):>6} {errors[op]:>6} "
+            f"{p50 * 1000:>8.1f} {p90 * 1000:>8.1f} {p99 * 1000:>8.1f}"
+        )
+
+    retries = defaultdict(int)
+    for i in metrics.registry.dump():
+        if i["name"] == "whats.retries":
+            retries[i["labels"]["reason"]] += i["value"]
+    print(f"retries: {dict(retries)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="base url of a running Graph API stand-in")
+    parser.add_argument("--ops", default=",".join(OPS))
+    parser.add_argument("--rps", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--errors", type=float, default=0)
+    parser.add_argument("--throttle", type=float, default=0)
+    parser.add_argument("--media-size", type=int, default=256 * 1024)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    # retries are counted in the report instead
+    logging.getLogger("wa").setLevel(logging.ERROR)
+
+    serving = None
+    server = None
+    url = args.url
+    if url is None:
+        faults = Faults(
+            latency=args.latency,
+            jitter=args.jitter,
+            errors=args.errors,
+            throttle=args.throttle,
+            media_size=args.media_size,
+        )
+        config = uvicorn.Config(create(faults), port=args.port, log_level="warning")
+        server = uvicorn.Server(config)
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        url = f"http://127.0.0.1:{args.port}/v22.0"
+
+    whats = WhatsApp(
+        access_token="token",
+        sender_id="sender",
+        base_url=url,
+        transport=Transport(retries=args.retries, max_connections=100),
+    )
+    try:
+        await drive(whats, args.ops.split(","), args.rps, args.duration)
+    finally:
+        await whats.client.aclose()
+        if server is not None and serving is not None:
+            server.should_exit = True
+            await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
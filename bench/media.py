@@ -0,0 +1,104 @@
+"""Peak memory of a media download + upload, spooled in memory vs. streamed
+
+The Graph API is an `httpx.MockTransport` serving random bytes and S3 is a
+client dropping whatever it receives, so only our own buffering is measured.
+
+    uv run python -m bench.media
+"""
+
+import asyncio
+import os
+import tracemalloc
+from tempfile import SpooledTemporaryFile
+from types import SimpleNamespace
+
+import httpx
+
+from wa.blob import Store
+from wa.whats.client import WhatsApp
+
+MiB = 1024 * 1024
+CHUNK = os.urandom(64 * 1024)
+
+
+def graph(size: int) -> httpx.MockTransport:
+    async def body():
+        for _ in range(size // len(CHUNK)):
+            yield CHUNK
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/media-id"):
+            media = {"id": "media-id", "url": "https://cdn.test/media"}
+            return httpx.Response(200, json={**media, "mime_type": "video/mp4"})
+        return httpx.Response(200, content=body())
+
+    return httpx.MockTransport(handle)
+
+
+class Sink:
+    """S3 client that drops every part"""
+
+    def put_object(self, **kwargs):
+        return {}
+
+    def upload_fileobj(self, Fileobj, **kwargs):
+        while Fileobj.read(8 * MiB):
+            pass
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload"}
+
+    def upload_part(self, PartNumber: int, **kwargs):
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, **kwargs):
+        return {}
+
+    def abort_multipart_upload(self, **kwargs):
+        return {}
+
+
+def whats(size: int) -> WhatsApp:
+    client = WhatsApp(access_token="token", sender_id="sender")
+    client.client = httpx.AsyncClient(transport=graph(size))
+    return client
+
+
+async def before(size: int):
+    # what the removed `WhatsApp.media` + `Store.save` did: spool it all first
+    wa = whats(size)
+    body = (await wa.client.get(f"{wa.base_url}/media-id")).json()
+    response = await wa.client.get(body["url"])
+    file = SpooledTemporaryFile()
+    async for chunk in response.aiter_bytes():
+        file.write(chunk)
+    file.seek(0)
+    Sink().upload_fileobj(file)
+
+
+async def after(size: int):
+    wa = whats(size)
+    bucket = SimpleNamespace(name="bucket", meta=SimpleNamespace(client=Sink()))
+    store = Store(bucket=bucket)  # type: ignore
+    async with wa.stream("media-id") as response:
+        await store.upload("key", response.aiter_bytes(), "video/mp4")
+
+
+def peak(fn, size: int) -> int:
+    tracemalloc.start()
+    asyncio.run(fn(size))
+    _, top = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return top
+
+
+def main():
+    print(f"{'media MiB':>9} {'before MiB':>11} {'after MiB':>10}")
+    for size in (1, 8, 32, 128):
+        b = peak(before, size * MiB) / MiB
+        a = peak(after, size * MiB) / MiB
+        print(f"{size:>9} {b:>11.1f} {a:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
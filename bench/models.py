@@ -0,0 +1,49 @@
+"""Webhook schema decoding throughput and allocations, per payload of the corpus
+
+uv run python -m bench.models
+"""
+
+import timeit
+import tracemalloc
+
+from wa.whats.models import WebhookAdapter
+
+from .payloads import CORPUS
+
+
+def rate(body: bytes, number: int = 5_000) -> float:
+    run = lambda: WebhookAdapter.validate_json(body)  # noqa: E731
+    seconds = min(timeit.repeat(run, number=number, repeat=5))
+    return number / seconds
+
+
+def allocations(body: bytes, number: int = 1_000) -> tuple[float, float]:
+    """Memory blocks and bytes held by each decoded payload"""
+    WebhookAdapter.validate_json(body)  # warm up
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = [WebhookAdapter.validate_json(body) for _ in range(number)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(i.count_diff for i in stats)
+    size = sum(i.size_diff for i in stats)
+    del results
+    return blocks / number, size / number
+
+
+def main():
+    print(
+        f"{'payload':<10} {'bytes':>6} {'decodes/s':>12} {'blocks':>8} {'bytes held':>10}"
+    )
+    for name, body in CORPUS.items():
+        blocks, size = allocations(body)
+        print(
+            f"{name:<10} {len(body):>6} {rate(body):>12,.0f} {blocks:>8.0f} {size:>10,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
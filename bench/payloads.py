@@ -0,0 +1,119 @@
+"""Realistic webhook payloads used by the benchmarks"""
+
+import json
+from typing import Any
+
+SENDER = "5511999999999"
+
+
+def _value(messages: list[dict], statuses: list[dict]) -> dict[str, Any]:
+    return {
+        "messaging_product": "whatsapp",
+        "metadata": {
+            "display_phone_number": "15550000000",
+            "phone_number_id": "123456789012345",
+        },
+        "contacts": [{"wa_id": SENDER, "profile": {"name": "Someone"}}]
+        if messages
+        else [],
+        "messages": messages,
+        "statuses": statuses,
+    }
+
+
+def webhook(
+    messages: list[dict] | None = None,
+    statuses: list[dict] | None = None,
+) -> dict[str, Any]:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "102290129340398",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": _value(messages or [], statuses or []),
+                    },
+                ],
+            }
+        ],
+    }
+
+
+def text(i: int = 0, body: str = "add buy milk to my todo list") -> dict[str, Any]:
+    return {
+        "from": SENDER,
+        "id": f"wamid.HBgNNTUxMTk5OTk5OTk5ORUCABIYFjNFQjA{i:08d}",
+        "timestamp": "1714000000",
+        "type": "text",
+        "text": {"body": body},
+    }
+
+
+def _media(i: int, type: str, **media: Any) -> dict[str, Any]:
+    return {
+        "from": SENDER,
+        "id": f"wamid.HBgNNTUxMTk5OTk5OTk5ORUCABIYFkE{i:08d}",
+        "timestamp": "1714000000",
+        "type": type,
+        type: {
+            "id": f"{1200000000000000 + i}",
+            "sha256": "mXzPzq3Qbg1mNl3o+7TfMZ5gZ9b1pC1kG2tMZQ9bRkU=",
+            **media,
+        },
+    }
+
+
+def image(i: int = 0) -> dict[str, Any]:
+    return _media(i, "image", mime_type="image/jpeg", caption="what is this?")
+
+
+def document(i: int = 0) -> dict[str, Any]:
+    return _media(i, "document", mime_type="application/pdf", filename="bill.pdf")
+
+
+def audio(i: int = 0) -> dict[str, Any]:
+    return _media(i, "audio", mime_type="audio/ogg; codecs=opus", voice=True)
+
+
+def reply(i: int = 0) -> dict[str, Any]:
+    """A text quoting a previous message"""
+    return {
+        **text(i, "and remove the second one"),
+        "context": {"from": "15550000000", "id": f"wamid.HBgNNTUxMTk{i:08d}"},
+    }
+
+
+def status(i: int = 0, status: str = "delivered") -> dict[str, Any]:
+    return {
+        "id": f"wamid.HBgNNTUxMTk5OTk5OTk5ORUCABEYEjE{i:08d}",
+        "status": status,
+        "timestamp": "1714000001",
+        "recipient_id": SENDER,
+        "conversation": {
+            "id": "b8ee7d6fc1d3c5a1e5e7ffb4b2bf1a37",
+            "expiration_timestamp": "1714086400",
+            "origin": {"type": "service"},
+        },
+        "pricing": {"pricing_model": "CBP", "category": "service"},
+    }
+
+
+CORPUS: dict[str, bytes] = {
+    "text": json.dumps(webhook(messages=[text()])).encode(),
+    "reply": json.dumps(webhook(messages=[reply()])).encode(),
+    "image": json.dumps(webhook(messages=[image()])).encode(),
+    "document": json.dumps(webhook(messages=[document()])).encode(),
+    "audio": json.dumps(webhook(messages=[audio()])).encode(),
+    "status": json.dumps(webhook(statuses=[status()])).encode(),
+    "media": json.dumps(
+        webhook(messages=[f(i) for i in range(3) for f in (image, document, audio)])
+    ).encode(),
+    "batch": json.dumps(
+        webhook(
+            messages=[text(i) for i in range(5)],
+            statuses=[status(i, s) for i in range(5) for s in ("sent", "read")],
+        )
+    ).encode(),
+}
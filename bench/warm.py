@@ -0,0 +1,49 @@
+"""First request latency of each client, cold vs. after `wa.warm.warm`
+
+Needs the real credentials in `.env`, it talks to the real services.
+
+    uv run python -m bench.warm
+"""
+
+import asyncio
+import time
+
+import wa.dynamo
+import wa.warm
+from wa.config import Config
+from wa.resources import Resources
+
+
+async def first(budget: float, warmed: bool) -> dict[str, float]:
+    cfg = Config()  # type: ignore
+    wa.dynamo.init(cfg)
+    res = Resources.create(cfg)
+    try:
+        if warmed:
+            await wa.warm.warm(res, budget)
+        took = {}
+        for name, fn in wa.warm.TARGETS.items():
+            start = time.perf_counter()
+            try:
+                await fn(res)
+            except Exception as e:
+                print(f"{name}: {e}")
+            took[name] = time.perf_counter() - start
+        return took
+    finally:
+        await res.aclose()
+
+
+async def main():
+    budget = 10
+    cold = await first(budget, warmed=False)
+    warm = await first(budget, warmed=True)
+
+    print(f"{'target':<8} {'cold ms':>10} {'warm ms':>10} {'saved ms':>10}")
+    for name in wa.warm.TARGETS:
+        c, w = cold[name] * 1000, warm[name] * 1000
+        print(f"{name:<8} {c:>10.1f} {w:>10.1f} {c - w:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,44 @@
+import asyncio
+import contextlib
+
 from mangum import Mangum
 
 import wa.app
+import wa.queue
+import wa.warm
 
 # This is simply the file used to run the app in AWS
 app = wa.app.create()
-handler = Mangum(app)
+
+# mangum runs on the current event loop, share it with the queue consumer
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+# start the app once per Lambda environment instead of once per invocation, so
+# clients and their connections are reused by the following invocations
+stack = contextlib.AsyncExitStack()
+app.state.warm_in_background = False
+loop.run_until_complete(stack.enter_async_context(app.router.lifespan_context(app)))
+mangum = Mangum(app, lifespan="off")
+
+# the loop only runs during invocations, a background warm up would compete with
+# the first one. Init runs with a full CPU instead, warm every service there
+if app.state.resources.config.WARM_UP:
+    budget = app.state.resources.config.WARM_UP_BUDGET
+    loop.run_until_complete(wa.warm.warm(app.state.resources, budget))
+
+
+def handler(event: dict, context):
+    res = app.state.resources
+    try:
+        # scheduled pings keep the connections open between invocations
+        if wa.warm.is_ping(event):
+            budget = res.config.WARM_UP_BUDGET
+            return loop.run_until_complete(wa.warm.warm(res, budget))
+        # messages enqueued by the webhook when `WEBHOOK_QUEUE=sqs`
+        if wa.queue.is_sqs_event(event):
+            return loop.run_until_complete(wa.queue.consume(app, event))
+        return mangum(event, context)
+    finally:
+        # the environment may be frozen or killed after the invocation
+        loop.run_until_complete(res.writer.flush())
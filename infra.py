@@ -3,9 +3,13 @@ from aws_cdk import App, Duration, RemovalPolicy, Stack
 from aws_cdk import aws_apigateway as apigw
 from aws_cdk import aws_cloudwatch as cloudwatch
 from aws_cdk import aws_dynamodb as dynamodb
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as events_targets
 from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_lambda_event_sources as lambda_events
 from aws_cdk import aws_logs as logs
 from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_sqs as sqs
 from constructs import Construct
 
 from wa.config import Config
@@ -90,6 +94,7 @@ class WhatsAppStack(Stack):
                 name="key",
                 type=dynamodb.AttributeType.STRING,
             ),
+            time_to_live_attribute="ttl",
             removal_policy=RemovalPolicy.DESTROY,
         )
 
@@ -117,6 +122,28 @@ class WhatsAppStack(Stack):
             versioned=False,
         )
 
+        # messages are processed here after the webhook responds, FIFO so the
+        # messages of a sender (the message group) are processed in order
+        queue = sqs.Queue(
+            self,
+            f"{id}-queue",
+            queue_name=f"{id}-queue.fifo",
+            fifo=True,
+            # at least 6 times the function timeout, as recommended by AWS
+            visibility_timeout=Duration.minutes(6),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=sqs.Queue(
+                    self,
+                    f"{id}-queue-dlq",
+                    queue_name=f"{id}-queue-dlq.fifo",
+                    fifo=True,
+                    removal_policy=RemovalPolicy.DESTROY,
+                ),
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
         # Create Lambda function for FastAPI with Mangum adapter
         function = lambda_.Function(
             self,
@@ -131,7 +158,7 @@ class WhatsAppStack(Stack):
             ),
             # runtine
             runtime=lambda_.Runtime.PYTHON_3_13,
-            timeout=Duration.seconds(10),
+            timeout=Duration.seconds(60),
             memory_size=1024,
             environment={
                 # dynamo
@@ -140,6 +167,11 @@ class WhatsAppStack(Stack):
                 "DYNAMO_DB_TABLE_TOOLS": t_tools.table_name,
                 # s3
                 "AWS_S3_BUCKET_RAG": bucket.bucket_name,
+                # sqs
+                "AWS_SQS_QUEUE_URL": queue.queue_url,
+                "WEBHOOK_QUEUE": "sqs",
+                # open connections during init
+                "WARM_UP": "true",
                 # helicone
                 "HELICONE_API_KEY": cfg.HELICONE_API_KEY,
                 # whatsapp
@@ -170,6 +202,27 @@ class WhatsAppStack(Stack):
         t_events.grant_read_write_data(function)
         t_tools.grant_read_write_data(function)
         bucket.grant_read_write(function)
+        queue.grant_send_messages(function)
+
+        function.add_event_source(
+            lambda_events.SqsEventSource(
+                queue,
+                # a text takes up to 45 seconds, plus the admission wait and the
+                # coalesce window, and the records of a sender run in turn. A
+                # batch that times out comes back whole, one record always fits
+                batch_size=1,
+                report_batch_item_failures=True,
+            )
+        )
+
+        # keeps the connections of a warm environment open between webhooks
+        events.Rule(
+            self,
+            f"{id}-warm",
+            rule_name=f"{id}-warm",
+            schedule=events.Schedule.rate(Duration.minutes(5)),
+            targets=[events_targets.LambdaFunction(function)],
+        )
 
         # Create API Gateway
         api = apigw.LambdaRestApi(
@@ -0,0 +1,105 @@
+"""Claims of messages whose processing did not happen are released, so that
+WhatsApp's redelivery is not dropped as a duplicate"""
+
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+from pynamodb.exceptions import PutError
+
+from wa.dedupe import Dedupe
+from wa.dynamo import aio
+from wa.routes import PostContext, receive
+from wa.whats import models
+
+
+class Dynamo:
+    """Stands in for the DynamoDB client, holding the claims written"""
+
+    def __init__(self):
+        self.claims: set[str] = set()
+        self.fail: set[str] = set()
+        self.delay = 0.0
+
+    async def put(self, item, condition=None):
+        await asyncio.sleep(self.delay)
+        reason = None
+        if item.key in self.fail:
+            reason = "InternalServerError"
+        elif item.key in self.claims:
+            reason = "ConditionalCheckFailedException"
+        if reason is not None:
+            error = {"Error": {"Code": reason, "Message": ""}}
+            cause = ClientError(error, "PutItem")  # type: ignore
+            raise PutError(f"PutItem failed: {reason}", cause)
+        self.claims.add(item.key)
+
+    async def delete(self, item):
+        self.claims.discard(item.key)
+
+
+@pytest.fixture
+def dynamo(monkeypatch: pytest.MonkeyPatch) -> Dynamo:
+    dynamo = Dynamo()
+    monkeypatch.setattr(aio, "_client", dynamo)
+    return dynamo
+
+
+def webhook(*ids: str) -> models.Webhook:
+    messages = [
+        {
+            "from": "5511999999999",
+            "id": id,
+            "timestamp": "1714000000",
+            "type": "text",
+            "text": {"body": "hi"},
+        }
+        for id in ids
+    ]
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {
+            "display_phone_number": "15550000000",
+            "phone_number_id": "123456789012345",
+        },
+        "messages": messages,
+    }
+    entry = {"id": "1", "changes": [{"field": "messages", "value": value}]}
+    data = {"object": "whatsapp_business_account", "entry": [entry]}
+    return models.Webhook.model_validate(data)
+
+
+def test_failed_claim_releases_the_others(dynamo: Dynamo):
+    dedupe = Dedupe()
+    dynamo.fail.add("wamid.2")
+    ctx = PostContext(
+        handler=None,  # type: ignore
+        data=webhook("wamid.1", "wamid.2", "wamid.3"),
+        config=None,  # type: ignore
+        queue=None,
+        dedupe=dedupe,
+    )
+
+    with pytest.raises(PutError):
+        asyncio.run(receive(ctx))
+
+    assert dynamo.claims == set()
+    assert not dedupe.seen
+
+
+def test_cancelled_claim_is_released(dynamo: Dynamo):
+    dedupe = Dedupe()
+    dynamo.delay = 0.05
+    msg = webhook("wamid.1").messages()[0]
+
+    async def main():
+        claim = asyncio.create_task(dedupe.message(msg))
+        await asyncio.sleep(0)
+        claim.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await claim
+
+    asyncio.run(main())
+
+    assert dynamo.claims == set()
+    assert not dedupe.seen
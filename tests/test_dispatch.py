@@ -0,0 +1,32 @@
+"""Messages waiting on the limit of their type don't hold global admission
+slots, so other types keep running"""
+
+import asyncio
+
+from wa.admission import Admission
+from wa.dispatch import Route
+
+
+def test_waiting_on_route_limit_holds_no_slot():
+    admission = Admission(limit=2, queue=0, timeout=0.01)
+    release = asyncio.Event()
+
+    async def slow(handler, arg):
+        await release.wait()
+
+    async def fast(handler, arg):
+        return arg
+
+    async def main():
+        image = Route(type="image", fn=slow, limit=1, timeout=5)
+        text = Route(type="text", fn=fast, limit=4, timeout=5)
+
+        images = [asyncio.create_task(image(None, i, admission.slot)) for i in range(4)]
+        await asyncio.sleep(0.05)
+        # one image runs, the others wait on the image limit, not on a slot
+        assert await text(None, "hi", admission.slot) == "hi"
+
+        release.set()
+        await asyncio.gather(*images)
+
+    asyncio.run(main())
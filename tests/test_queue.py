@@ -0,0 +1,61 @@
+"""SQS records processed before are skipped when redelivered, e.g. in a batch
+whose invocation timed out"""
+
+import asyncio
+
+import pytest
+
+from wa.dynamo import aio
+from wa.queue import SQSQueue, _dump
+from wa.whats import models
+
+
+class Dynamo:
+    """Stands in for the DynamoDB client, holding the items written"""
+
+    def __init__(self):
+        self.items: dict[tuple[str, str], object] = {}
+
+    async def get(self, cls, hash_key, range_key=None):
+        return self.items.get((hash_key, range_key))
+
+    async def put(self, item, condition=None):
+        self.items[item.id, item.key] = item
+
+
+@pytest.fixture
+def dynamo(monkeypatch: pytest.MonkeyPatch) -> Dynamo:
+    dynamo = Dynamo()
+    monkeypatch.setattr(aio, "_client", dynamo)
+    return dynamo
+
+
+def record(id: str) -> dict:
+    data = {
+        "from": "5511999999999",
+        "id": id,
+        "timestamp": "1714000000",
+        "type": "text",
+        "text": {"body": "hi"},
+    }
+    msg = models.MessageObjectAdapter.validate_python(data)
+    attributes = {"MessageGroupId": "5511999999999"}
+    return {"messageId": f"sqs-{id}", "body": _dump(msg), "attributes": attributes}
+
+
+def test_redelivered_records_are_skipped(dynamo: Dynamo):
+    processed = []
+
+    async def process(msg: models.MessageObject):
+        processed.append(msg.id)
+
+    async def main():
+        first = [record("wamid.1"), record("wamid.2")]
+        assert await SQSQueue.consume(first, process) == []
+        # the batch came back, with a message that was not processed yet
+        again = [*first, record("wamid.3")]
+        assert await SQSQueue.consume(again, process) == []
+
+    asyncio.run(main())
+
+    assert processed == ["wamid.1", "wamid.2", "wamid.3"]
@@ -0,0 +1,108 @@
+"""Clients are built once per process, shared by every request and closed on
+shutdown"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import wa.app
+import wa.deps as deps
+
+ENV = {
+    "WHATSAPP_VERIFY_TOKEN": "test",
+    "WHATSAPP_ACCESS_TOKEN": "test",
+    "WHATSAPP_SENDER_ID": "123456789012345",
+    "WHATSAPP_SENDER_NUMBER": "15550000000",
+    "WHATSAPP_APP_SECRET": "test",
+    "WHATSAPP_HTTP2": "false",
+    "OPENAI_API_KEY": "test",
+    "HELICONE_API_KEY": "test",
+    "GEMINI_API_KEY": "",
+    "DYNAMO_DB_TABLE_MESSAGES": "MESSAGES_TABLE",
+    "DYNAMO_DB_TABLE_EVENTS": "EVENTS_TABLE",
+    "DYNAMO_DB_TABLE_TOOLS": "TOOLS_TABLE",
+    "AWS_S3_BUCKET_RAG": "rag-bucket",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+
+class Graph(BaseHTTPRequestHandler):
+    """Stands in for the Graph API, counting the connections it accepts"""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        Graph.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def graph():
+    Graph.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Graph)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"http://{host}:{port}/v22.0"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(monkeypatch: pytest.MonkeyPatch, graph: str) -> FastAPI:
+    for key, value in ENV.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setenv("WHATSAPP_BASE_URL", graph)
+
+    app = wa.app.create()
+    app.state.seen = []
+
+    @app.get("/probe")
+    async def probe(
+        res: deps.DepResources, whats: deps.DepWhatsApp, cfg: deps.DepConfig
+    ):
+        response = await whats.client.get(f"{whats.base_url}/probe")
+        response.raise_for_status()
+        app.state.seen.append((res, cfg, whats, whats.client))
+
+    return app
+
+
+def test_requests_share_clients(app: FastAPI):
+    with TestClient(app) as client:
+        for _ in range(3):
+            assert client.get("/probe").status_code == 200
+
+    first, *rest = app.state.seen
+    for seen in rest:
+        assert all(a is b for a, b in zip(first, seen))
+
+
+def test_requests_reuse_connections(app: FastAPI):
+    with TestClient(app) as client:
+        for _ in range(3):
+            assert client.get("/probe").status_code == 200
+
+    assert Graph.connections == 1
+
+
+def test_shutdown_closes_clients(app: FastAPI):
+    with TestClient(app) as client:
+        assert client.get("/probe").status_code == 200
+        res = app.state.resources
+
+    assert res.whats.client.is_closed
@@ -0,0 +1,87 @@
+"""The writer buffers items into BatchWriteItem calls, which DynamoDB rejects
+whole when two items share a key"""
+
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+from pynamodb.exceptions import PutError
+
+from wa.dynamo import aio
+from wa.dynamo.whatsapp import WhatsAppStatus, WhatsAppWriter
+
+
+class Dynamo:
+    """Stands in for the DynamoDB client, failing batches the way DynamoDB does"""
+
+    def __init__(self):
+        self.written: list[WhatsAppStatus] = []
+        self.error: str | None = None
+
+    async def batch_write(self, items):
+        items = list(items)
+        keys = {(i.id, i.key) for i in items}
+        reason = self.error
+        if len(keys) < len(items):
+            reason = "ValidationException"
+        if reason is not None:
+            error = {"Error": {"Code": reason, "Message": ""}}
+            cause = ClientError(error, "BatchWriteItem")  # type: ignore
+            raise PutError(f"BatchWriteItem failed: {reason}", cause)
+        self.written.extend(items)
+
+
+@pytest.fixture
+def dynamo(monkeypatch: pytest.MonkeyPatch) -> Dynamo:
+    dynamo = Dynamo()
+    monkeypatch.setattr(aio, "_client", dynamo)
+    return dynamo
+
+
+def status(wamid: str, value: str) -> WhatsAppStatus:
+    return WhatsAppStatus(key=wamid, data={"status": value})
+
+
+def test_flush_keeps_last_status_of_a_message(dynamo: Dynamo):
+    async def main():
+        writer = WhatsAppWriter()
+        await writer.put(status("wamid.1", "sent"))
+        await writer.put(status("wamid.1", "delivered"))
+        await writer.put(status("wamid.2", "sent"))
+        await writer.flush()
+
+        await writer.put(status("wamid.3", "sent"))
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(main())
+
+    written = [(i.key, i.data["status"]) for i in dynamo.written]
+    assert written == [
+        ("wamid.1", "delivered"),
+        ("wamid.2", "sent"),
+        ("wamid.3", "sent"),
+    ]
+    assert writer.items == []
+
+
+def test_flush_drops_items_on_non_retryable_errors(dynamo: Dynamo):
+    async def main():
+        writer = WhatsAppWriter()
+        dynamo.error = "ThrottlingException"
+        await writer.put(status("wamid.1", "sent"))
+        with pytest.raises(PutError):
+            await writer.flush()
+        assert len(writer.items) == 1
+
+        dynamo.error = "ValidationException"
+        await writer.flush()
+        assert writer.items == []
+
+        dynamo.error = None
+        await writer.put(status("wamid.2", "sent"))
+        await writer.flush()
+
+    asyncio.run(main())
+
+    assert [i.key for i in dynamo.written] == ["wamid.2"]
@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+import wa.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Busy(Exception):
+    """Raised when there is no capacity left to run the agent"""
+
+
+@dataclass
+class Admission:
+    """Limits the number of concurrent agent runs to `limit`.
+
+    Up to `queue` runs wait for a slot, for at most `timeout` seconds. Anything
+    over that is shed with `Busy`, so the caller can defer it or tell the user.
+
+    Metrics:
+    - `admission.running`: agent runs holding a slot
+    - `admission.waiting`: agent runs waiting for a slot
+    - `admission.wait`: how long runs waited for a slot
+    - `admission.shed{reason}`: runs shed because the queue was `full` or the
+      wait hit the `timeout`
+    """
+
+    limit: int = 8
+    queue: int = 32
+    timeout: float = 5
+    waiting: int = 0
+    semaphore: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.semaphore = asyncio.Semaphore(self.limit)
+
+    def _shed(self, reason: str):
+        logger.warning("slot(): shedding, %s", reason)
+        metrics.counter("admission.shed", reason=reason).inc()
+        raise Busy(reason)
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self.semaphore.locked() and self.waiting >= self.queue:
+            self._shed("full")
+
+        self.waiting += 1
+        metrics.gauge("admission.waiting").set(self.waiting)
+        start = time.perf_counter()
+
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self.semaphore.acquire()
+        except TimeoutError:
+            self._shed("timeout")
+        finally:
+            self.waiting -= 1
+            metrics.gauge("admission.waiting").set(self.waiting)
+            metrics.histogram("admission.wait").observe(time.perf_counter() - start)
+
+        metrics.gauge("admission.running").inc()
+        try:
+            yield
+        finally:
+            metrics.gauge("admission.running").dec()
+            self.semaphore.release()
@@ -1,53 +1,219 @@
 import asyncio
-import functools
+import base64
+import binascii
+import hashlib
 import logging
-from dataclasses import dataclass
-from typing import IO
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterable
 
-from types_boto3_s3.service_resource import Bucket
+import wa.metrics as metrics
+from wa.executor import Executor
+
+if TYPE_CHECKING:
+    # stubs only, importing them at runtime costs as much as boto3 itself
+    from types_boto3_s3.service_resource import Bucket
 
 logger = logging.getLogger(__name__)
 
+PART_SIZE = 5 * 1024 * 1024
+"""Smallest part accepted by S3 multipart uploads, except for the last one"""
+
+
+def digest(sha256: str | None) -> str | None:
+    """Normalizes a sha256 into hex. The Graph API sends hex when looking up a
+    media, but webhooks send it in base64"""
+    if not sha256:
+        return None
+    try:
+        raw = bytes.fromhex(sha256)
+    except ValueError:
+        try:
+            raw = base64.b64decode(sha256, validate=True)
+        except binascii.Error:
+            return None
+    return raw.hex() if len(raw) == hashlib.sha256().digest_size else None
+
+
+@dataclass
+class Upload:
+    key: str
+    sha256: str
+    size: int
+
 
 @dataclass
 class Store:
-    bucket: Bucket
-
-    async def save(self, key: str, fin: IO[bytes] | str, mime: str):
-        logger.info("save(%s): %s", key, mime)
-        loop = asyncio.get_event_loop()
-
-        if not isinstance(fin, str):
-            await loop.run_in_executor(
-                None,
-                functools.partial(
-                    self.bucket.upload_fileobj,
-                    Fileobj=fin,
-                    Key=key,
-                    ExtraArgs={"ContentType": mime},
-                ),
-            )
-            return
-
-        obj = self.bucket.Object(key)
-        await loop.run_in_executor(
-            None,
-            functools.partial(
-                obj.put,
-                Body=fin,
-                ContentType=mime,
-            ),
+    """Media is stored once per content under `blobs/sha256/<hex>`, and each
+    user gets a small alias object pointing to it.
+
+    Presigned URLs are cached until `margin` seconds before they expire. boto3
+    calls run in `executor`, size the client's connection pool to match it.
+
+    Metrics:
+    - `store.blobs{result}`: blobs that were already stored (`hit`) or not
+    - `store.presigned{result}`: presigned URLs served from the cache or not
+    """
+
+    bucket: "Bucket"
+    executor: Executor = field(default_factory=lambda: Executor("s3"))
+    part_size: int = PART_SIZE
+    margin: float = 60
+    size: int = 1024
+    urls: OrderedDict[str, tuple[str, float]] = field(
+        default_factory=OrderedDict, repr=False
+    )
+
+    @staticmethod
+    def key(digest: str) -> str:
+        return f"blobs/sha256/{digest}"
+
+    def _call(self, fn, **kwargs):
+        return self.executor.run(fn, Bucket=self.bucket.name, **kwargs)
+
+    async def exists(self, digest: str) -> bool:
+        client = self.bucket.meta.client
+        try:
+            await self._call(client.head_object, Key=self.key(digest))
+        except client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            metrics.counter("store.blobs", result="miss").inc()
+            return False
+        metrics.counter("store.blobs", result="hit").inc()
+        return True
+
+    async def put(
+        self, chunks: AsyncIterable[bytes], mime: str, digest: str | None = None
+    ) -> Upload:
+        """Uploads a blob under the `digest` it claims to have. When the digest
+        is unknown or wrong, the blob is moved to the one actually computed"""
+        key = self.key(digest) if digest else f"blobs/incoming/{uuid.uuid4()}"
+        upload = await self.upload(key, chunks, mime)
+        if upload.sha256 == digest:
+            return upload
+
+        if digest is not None:
+            logger.warning("put(%s): content hashes to %s", digest, upload.sha256)
+        client = self.bucket.meta.client
+        final = self.key(upload.sha256)
+        await self._call(
+            client.copy_object,
+            Key=final,
+            CopySource={"Bucket": self.bucket.name, "Key": key},
         )
+        await self._call(client.delete_object, Key=key)
+        return Upload(key=final, sha256=upload.sha256, size=upload.size)
+
+    async def alias(self, key: str, digest: str, mime: str):
+        """Empty object under `key` pointing to the blob in its metadata"""
+        logger.info("alias(%s): %s", key, digest)
+        await self._call(
+            self.bucket.meta.client.put_object,
+            Key=key,
+            Body=b"",
+            ContentType=mime,
+            Metadata={"sha256": digest},
+        )
+
+    async def upload(self, key: str, chunks: AsyncIterable[bytes], mime: str) -> Upload:
+        """Uploads a stream without holding it in memory, hashing it on the way.
+
+        Chunks are buffered into parts of `part_size`, and only one part is
+        uploaded while the next is buffered, so memory stays at about two parts
+        whatever the size. Streams smaller than a part are a single `put`.
+        """
+        logger.info("upload(%s): %s", key, mime)
+        client = self.bucket.meta.client
+        sha256 = hashlib.sha256()
+        size = 0
+
+        def call(fn, **kwargs):
+            return self._call(fn, Key=key, **kwargs)
+
+        upload_id: str | None = None
+        parts: list[dict] = []
+        pending: asyncio.Future | None = None
+        buffer = bytearray()
+
+        async def flush():
+            nonlocal upload_id, pending
+            if upload_id is None:
+                created = await call(client.create_multipart_upload, ContentType=mime)
+                upload_id = created["UploadId"]
+            if pending is not None:
+                await pending
+
+            number = len(parts) + 1
+            body = bytes(buffer)
+            buffer.clear()
+
+            async def part():
+                uploaded = await call(
+                    client.upload_part,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=body,
+                )
+                parts.append({"ETag": uploaded["ETag"], "PartNumber": number})
+
+            pending = asyncio.ensure_future(part())
+
+        try:
+            async for chunk in chunks:
+                sha256.update(chunk)
+                size += len(chunk)
+                buffer += chunk
+                if len(buffer) >= self.part_size:
+                    await flush()
+
+            if upload_id is None:
+                await call(client.put_object, Body=bytes(buffer), ContentType=mime)
+            else:
+                if buffer:
+                    await flush()
+                assert pending is not None
+                await pending
+                await call(
+                    client.complete_multipart_upload,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+        except BaseException:
+            # the part in flight runs in a thread, let it finish before aborting
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
+            if upload_id is not None:
+                logger.warning("upload(%s): aborting multipart upload", key)
+                await call(client.abort_multipart_upload, UploadId=upload_id)
+            raise
+
+        logger.info("upload(%s): %s bytes, %s parts", key, size, len(parts))
+        return Upload(key=key, sha256=sha256.hexdigest(), size=size)
+
+    async def presigned(self, key: str, duration: int = 600) -> str:
+        cached = self.urls.get(key)
+        if cached is not None:
+            url, expires = cached
+            if expires - self.margin > time.time():
+                self.urls.move_to_end(key)
+                metrics.counter("store.presigned", result="hit").inc()
+                return url
 
-    async def presigned(self, key: str, duration: int = 600):
         logger.info("presigned(%s): %s", key, duration)
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            functools.partial(
-                self.bucket.meta.client.generate_presigned_url,
-                ClientMethod="get_object",
-                Params={"Bucket": self.bucket.name, "Key": key},
-                ExpiresIn=duration,
-            ),
+        metrics.counter("store.presigned", result="miss").inc()
+        expires = time.time() + duration
+        url = await self.executor.run(
+            self.bucket.meta.client.generate_presigned_url,
+            ClientMethod="get_object",
+            Params={"Bucket": self.bucket.name, "Key": key},
+            ExpiresIn=duration,
         )
+
+        self.urls[key] = (url, expires)
+        self.urls.move_to_end(key)
+        if len(self.urls) > self.size:
+            self.urls.popitem(last=False)
+        return url
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable
+
+import wa.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Cache[K: Hashable, V]:
+    """LRU of up to `size` entries, each kept until its own expiry.
+
+    With `weigh`, entries are also evicted while their total weight, e.g. their
+    approximate bytes, is over `capacity`. Concurrent `load`s of the same
+    missing key share a single call.
+
+    Metrics:
+    - `cache.requests{cache,result}`: lookups that were a `hit`, a `miss` or
+      joined a load already running (`coalesced`)
+    - `cache.size{cache}`: entries held
+    - `cache.weight{cache}`: total weight of the entries, when weighed
+    """
+
+    name: str
+    size: int = 1024
+    weigh: Callable[[V], int] | None = None
+    capacity: int = 0
+    weight: int = 0
+    entries: OrderedDict[K, tuple[V, float, int]] = field(
+        default_factory=OrderedDict, repr=False
+    )
+    loading: dict[K, asyncio.Task[V]] = field(default_factory=dict, repr=False)
+
+    def _count(self, result: str):
+        metrics.counter("cache.requests", cache=self.name, result=result).inc()
+
+    def get(self, key: K) -> V | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires, _ = entry
+        if expires <= time.monotonic():
+            self.pop(key)
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def _gauges(self):
+        metrics.gauge("cache.size", cache=self.name).set(len(self.entries))
+        if self.weigh is not None:
+            metrics.gauge("cache.weight", cache=self.name).set(self.weight)
+
+    def put(self, key: K, value: V, ttl: float):
+        """Stores `value`, also when replacing it after changing it in place"""
+        if ttl <= 0:
+            return
+
+        weight = self.weigh(value) if self.weigh is not None else 0
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.weight -= previous[2]
+
+        self.entries[key] = (value, time.monotonic() + ttl, weight)
+        self.weight += weight
+        while len(self.entries) > self.size or (
+            # the newest entry is kept, even when too heavy on its own
+            self.capacity and self.weight > self.capacity and len(self.entries) > 1
+        ):
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.weight -= evicted
+        self._gauges()
+
+    def pop(self, key: K):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+        self._gauges()
+
+    async def load(self, key: K, fn: Callable[[], Awaitable[tuple[V, float]]]) -> V:
+        """Returns the cached value, or calls `fn` for a `(value, ttl)` pair"""
+        value = self.get(key)
+        if value is not None:
+            self._count("hit")
+            return value
+
+        task = self.loading.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            self._count("miss")
+
+            async def run() -> V:
+                try:
+                    value, ttl = await fn()
+                    self.put(key, value, ttl)
+                    return value
+                finally:
+                    del self.loading[key]
+
+            task = self.loading[key] = asyncio.create_task(run())
+
+        # a cancelled caller must not cancel the load shared with the others
+        return await asyncio.shield(task)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import wa.metrics as metrics
+import wa.whats.models as models
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Burst:
+    texts: list[models.TextMessage]
+    arrived: asyncio.Event = field(default_factory=asyncio.Event)
+    done: asyncio.Future[None] = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+@dataclass
+class Coalescer:
+    """Merges texts a sender sends in quick succession.
+
+    The first text of a burst waits `window` seconds, restarted by each new text
+    and capped at `limit` seconds, then runs `fn` with the whole burst. The
+    texts that joined it wait for that run and return `None`, or raise its
+    error, so the whole burst fails and is retried together.
+    """
+
+    window: float = 0
+    limit: float = 10
+    bursts: dict[str, Burst] = field(default_factory=dict, repr=False)
+
+    async def submit[T](
+        self,
+        msg: models.TextMessage,
+        fn: Callable[[list[models.TextMessage]], Awaitable[T]],
+    ) -> T | None:
+        if self.window <= 0:
+            return await fn([msg])
+
+        burst = self.bursts.get(msg.from_)
+        if burst is not None:
+            logger.info("submit(%s): joined burst of %s", msg.id, msg.from_)
+            burst.texts.append(msg)
+            burst.arrived.set()
+            # cancelling a text that joined does not cancel the burst
+            await asyncio.shield(burst.done)
+            return None
+
+        burst = self.bursts[msg.from_] = Burst(texts=[msg])
+        try:
+            await self._wait(burst, msg.from_)
+            logger.info("submit(%s): burst of %s texts", msg.id, len(burst.texts))
+            metrics.histogram("coalesce.size").observe(len(burst.texts))
+            metrics.counter("coalesce.merged").inc(len(burst.texts) - 1)
+            result = await fn(burst.texts)
+        except BaseException as e:
+            if len(burst.texts) > 1:
+                if not isinstance(e, Exception):
+                    e = RuntimeError(f"burst of {msg.id} was cancelled")
+                burst.done.set_exception(e)
+            raise
+        burst.done.set_result(None)
+        return result
+
+    async def _wait(self, burst: Burst, key: str):
+        deadline = time.monotonic() + self.limit
+        try:
+            while (remaining := deadline - time.monotonic()) > 0:
+                burst.arrived.clear()
+                try:
+                    timeout = min(self.window, remaining)
+                    await asyncio.wait_for(burst.arrived.wait(), timeout)
+                except TimeoutError:
+                    break
+        finally:
+            del self.bursts[key]
@@ -1,4 +1,4 @@
-from typing import Annotated
+from typing import Annotated, Literal
 
 from fastapi import Depends
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -25,9 +25,36 @@ class Config(BaseSettings):
     WHATSAPP_APP_SECRET: str
     """The app secret used to verify webhooks"""
 
+    WHATSAPP_BASE_URL: str = "https://graph.facebook.com/v22.0"
+    """Graph API url, point it to `bench.graph` to run without Meta"""
+
+    WHATSAPP_HTTP2: bool = True
+    """Talk HTTP/2 to the Graph API, multiplexing requests over one connection"""
+
+    WHATSAPP_MAX_CONNECTIONS: int = 20
+    """Maximum number of open connections to the Graph API"""
+
+    WHATSAPP_TIMEOUT: float = 10
+    """Seconds to wait for `send`, `reply` and `react` requests"""
+
+    WHATSAPP_TIMEOUT_MEDIA: float = 60
+    """Seconds to wait for each media lookup and download request"""
+
+    WHATSAPP_RETRIES: int = 3
+    """Retries of Graph API requests that failed with 429, 5xx or a network error"""
+
+    OUTBOX_RATE: float = 20
+    """Messages per second sent from each sender number"""
+
+    OUTBOX_BURST: float = 10
+    """Messages sent at once before pacing kicks in"""
+
     OPENAI_API_KEY: str
     """OpenAI API key"""
 
+    OPENAI_BASE_URL: str = "https://oai.helicone.ai/v1"
+    """OpenAI compatible endpoint, Helicone's proxy by default"""
+
     DYNAMO_DB_TABLE_MESSAGES: str
     """DynamoDB table name for sent/received messages"""
 
@@ -37,6 +64,46 @@ class Config(BaseSettings):
     DYNAMO_DB_TABLE_TOOLS: str
     """DynamoDB table name for tools"""
 
+    DYNAMO_DB_MAX_CONNECTIONS: int = 50
+    """Maximum number of open connections to DynamoDB, shared by every table. Also
+    the number of threads running DynamoDB calls, unless `DYNAMO_DB_NATIVE`"""
+
+    DYNAMO_DB_QUEUE: int = 64
+    """DynamoDB calls waiting for a thread before callers wait to submit more"""
+
+    DYNAMO_DB_NATIVE: bool = False
+    """Use the asyncio DynamoDB client instead of PynamoDB in threads. Faster at
+    low concurrency, but built on PynamoDB internals"""
+
+    HISTORY_FORMAT: Literal["map", "binary"] = "map"
+    """How agent messages are written: a DynamoDB map, or compressed JSON in a
+    single binary attribute (zstd with the `zstd` extra, zlib otherwise). Items
+    written in either format are always readable"""
+
+    HISTORY_TOKENS: int = 4000
+    """Approximate tokens of history sent with every prompt. The latest
+    messages are read until the budget is filled"""
+
+    HISTORY_PRUNE_TOOLS: bool = True
+    """Replace long tool arguments and returns in the history with a note of
+    their size, except in the latest message"""
+
+    HISTORY_CACHE_SIZE: int = 1024
+    """Maximum number of conversations whose latest messages are cached"""
+
+    HISTORY_CACHE_BYTES: int = 64 * 1024 * 1024
+    """Approximate memory cap of the cached conversations, measured as JSON"""
+
+    HISTORY_CACHE_TTL: float = 300
+    """Seconds a cached conversation is kept. Messages written by another
+    process show up after at most this long. `0` disables the cache"""
+
+    DYNAMO_DB_BATCH_SIZE: int = 25
+    """Number of buffered WhatsApp events written in a single batch (max 25)"""
+
+    DYNAMO_DB_BATCH_AGE: float = 1.0
+    """Seconds a buffered WhatsApp event waits before its batch is written"""
+
     HELICONE_API_KEY: str
     """Helicone API key"""
 
@@ -52,5 +119,66 @@ class Config(BaseSettings):
     AWS_ENDPOINT_URL: str | None = None
     """AWS endpoint URL. Used for local development"""
 
+    S3_WORKERS: int = 8
+    """Threads running blocking S3 calls, which is also the size of the S3
+    connection pool"""
+
+    S3_QUEUE: int = 64
+    """S3 calls waiting for a thread. Callers past that wait before submitting"""
+
+    AWS_SQS_QUEUE_URL: str | None = None
+    """SQS queue URL. Required when `WEBHOOK_QUEUE` is `sqs`"""
+
+    WEBHOOK_QUEUE: Literal["asyncio", "sqs"] | None = None
+    """Queue used to process messages after the webhook responds. When unset,
+    messages are processed before responding to the webhook"""
+
+    QUEUE_WORKERS: int = 4
+    """Number of workers consuming the `asyncio` queue"""
+
+    WARM_UP: bool = False
+    """Open the connection to the Graph API in the background after startup. In
+    Lambda, every service is warmed during init instead. Scheduled pings warm
+    every service"""
+
+    WARM_UP_BUDGET: float = 3
+    """Maximum seconds spent opening connections during startup or a warm ping"""
+
+    ADMISSION_LIMIT: int = 8
+    """Maximum number of agent runs at once"""
+
+    ADMISSION_QUEUE: int = 32
+    """Maximum number of agent runs waiting for a slot. Runs over that are shed"""
+
+    ADMISSION_TIMEOUT: float = 5
+    """Seconds an agent run waits for a slot before being shed"""
+
+    ADMISSION_DEFER: float = 30
+    """Seconds before a shed message is retried, when `WEBHOOK_QUEUE` is set.
+    Otherwise the sender is asked to try again later"""
+
+    COALESCE_WINDOW: float = 0
+    """Seconds to wait for more texts from a sender before answering them all at
+    once. Every new text restarts the wait. Disabled when `0`"""
+
+    COALESCE_LIMIT: float = 10
+    """Maximum seconds a burst of texts waits before being answered"""
+
+    METRICS_TOKEN: str | None = None
+    """Bearer token required by `GET /metrics`. The route is disabled when unset"""
+
+    DEDUPE_SIZE: int = 4096
+    """Number of recently seen WhatsApp ids kept in memory to drop redeliveries"""
+
+    QUEUE_SQS_POLL: bool = False
+    """Poll the SQS queue from this process. Used for local development, where
+    there is no Lambda event source"""
+
+    SQS_WORKERS: int = 4
+    """Threads running blocking SQS calls, a long poll holds one for 20s"""
+
+    SQS_QUEUE: int = 64
+    """SQS calls waiting for a thread. Callers past that wait before submitting"""
+
 
 DepConfig = Annotated[Config, Depends(lambda: Config())]
@@ -0,0 +1,74 @@
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import wa.dynamo as db
+import wa.whats.models as models
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Dedupe:
+    """Drops webhook redeliveries.
+
+    Recently seen ids are kept in an in-memory LRU. Messages are also claimed in
+    DynamoDB, so a redelivery that reaches another process is dropped as well.
+    Both are released when processing a message fails, so that its redelivery is
+    not dropped. Statuses are only checked against the LRU, storing them is idempotent.
+    """
+
+    size: int = 4096
+    seen: OrderedDict[str, None] = field(default_factory=OrderedDict, repr=False)
+
+    def _seen(self, key: str) -> bool:
+        if key in self.seen:
+            self.seen.move_to_end(key)
+            return True
+
+        self.seen[key] = None
+        if len(self.seen) > self.size:
+            self.seen.popitem(last=False)
+        return False
+
+    async def message(self, msg: models.MessageObject) -> bool:
+        """Returns `True` if the message was not processed before"""
+        key = f"message:{msg.id}"
+        if self._seen(key):
+            logger.info("message(%s): duplicate (memory)", msg.id)
+            return False
+
+        # shielded, a cancelled caller still learns if the claim was written
+        claim = asyncio.ensure_future(db.WhatsAppClaim(key=msg.id).aclaim())
+        try:
+            claimed = await asyncio.shield(claim)
+        except BaseException:
+            # let the redelivery try again
+            self.seen.pop(key, None)
+            with contextlib.suppress(Exception):
+                if await claim:
+                    await self.release(msg)
+            raise
+
+        if not claimed:
+            logger.info("message(%s): duplicate (dynamo)", msg.id)
+        return claimed
+
+    async def release(self, msg: models.MessageObject):
+        """Forgets a message that failed, so its redelivery is processed"""
+        logger.info("release(%s)", msg.id)
+        self.seen.pop(f"message:{msg.id}", None)
+        try:
+            await db.WhatsAppClaim(key=msg.id).arelease()
+        except Exception:
+            # the redelivery is dropped until the claim expires
+            logger.exception("release(%s): failed to delete the claim", msg.id)
+
+    def status(self, sts: models.StatusObject) -> bool:
+        """Returns `True` if the status was not processed before"""
+        if self._seen(f"status:{sts.id}:{sts.status}"):
+            logger.info("status(%s): duplicate %s", sts.id, sts.status)
+            return False
+        return True
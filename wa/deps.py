@@ -2,69 +2,37 @@ import logging
 from dataclasses import dataclass
 from typing import Annotated
 
-import boto3
-from fastapi import Body, Depends, Header, HTTPException, Request
-from openai import AsyncOpenAI
-from pydantic_ai import Agent
-from pydantic_ai.models import Model
-from pydantic_ai.models.gemini import GeminiModel
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.google_gla import GoogleGLAProvider
-from pydantic_ai.providers.openai import OpenAIProvider
-
-import wa.agents as agents
-from wa.blob import Store
+from fastapi import Depends, Header, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+import wa.dynamo as db
 from wa.config import Config
+from wa.dedupe import Dedupe
+from wa.queue import Queue
+from wa.resources import Resources
 from wa.whats.client import WhatsApp
-from wa.whats.models import Webhook
+from wa.whats.models import Webhook, WebhookAdapter
 
 logger = logging.getLogger(__name__)
 
 
-def dep_config() -> Config:
-    return Config()  # type: ignore
-
-
-DepConfig = Annotated[Config, Depends(dep_config)]
-
+def dep_resources(request: Request) -> Resources:
+    return request.app.state.resources
 
-def dep_model(cfg: DepConfig) -> Model:
-    if cfg.GEMINI_API_KEY:
-        logger.info("Using Gemini model")
-        return GeminiModel(
-            model_name="gemini-2.0-flash",
-            provider=GoogleGLAProvider(api_key=cfg.GEMINI_API_KEY),
-        )
 
-    logger.info("Using OpenAI model")
-    return OpenAIModel(
-        model_name="gpt-4o-mini",
-        provider=OpenAIProvider(
-            openai_client=AsyncOpenAI(
-                api_key=cfg.OPENAI_API_KEY,
-                base_url="https://oai.helicone.ai/v1",
-                default_headers={"Helicone-Auth": f"Bearer {cfg.HELICONE_API_KEY}"},
-            )
-        ),
-    )
+DepResources = Annotated[Resources, Depends(dep_resources)]
 
 
-DepModel = Annotated[Model, Depends(dep_model)]
+def dep_config(res: DepResources) -> Config:
+    return res.config
 
 
-def dep_agent():
-    return agents.agent
-
-
-DepAgent = Annotated[Agent[agents.State, str], Depends(dep_agent)]
+DepConfig = Annotated[Config, Depends(dep_config)]
 
 
-def dep_whatsapp(cfg: DepConfig):
-    return WhatsApp(
-        access_token=cfg.WHATSAPP_ACCESS_TOKEN,
-        sender_id=cfg.WHATSAPP_SENDER_ID,
-        verify_token=cfg.WHATSAPP_VERIFY_TOKEN,
-    )
+def dep_whatsapp(res: DepResources) -> WhatsApp:
+    return res.whats
 
 
 DepWhatsApp = Annotated[WhatsApp, Depends(dep_whatsapp)]
@@ -76,13 +44,13 @@ class WebhookContext:
     request: Request
     config: DepConfig
     signature: Annotated[str, Header(alias="x-hub-signature-256")]
-    body: Annotated[Webhook, Body()]
 
 
 _WebhookContext = Annotated[WebhookContext, Depends(WebhookContext)]
 
 
-async def dep_webhook(ctx: _WebhookContext):
+async def dep_webhook(ctx: _WebhookContext) -> Webhook:
+    # the body is read once and only parsed after the signature is checked
     signature = ctx.signature.removeprefix("sha256=")
     secret = ctx.config.WHATSAPP_APP_SECRET
     body = await ctx.request.body()
@@ -95,16 +63,38 @@ async def dep_webhook(ctx: _WebhookContext):
         raise HTTPException(status_code=403, detail="Invalid signature")
 
     logger.debug("Webhook verified")
-    return ctx.body
+
+    try:
+        return WebhookAdapter.validate_json(body)
+    except ValidationError as e:
+        logger.warning("Invalid webhook: %s", e)
+        raise RequestValidationError(e.errors(include_url=False), body=body)
 
 
 DepWebhook = Annotated[Webhook, Depends(dep_webhook)]
 
 
-def dep_store(cfg: DepConfig):
-    s3 = boto3.resource("s3", endpoint_url=cfg.AWS_ENDPOINT_URL)
-    bucket = s3.Bucket(cfg.AWS_S3_BUCKET_RAG)
-    return Store(bucket=bucket)
+def dep_queue(res: DepResources) -> Queue | None:
+    return res.queue
+
+
+DepQueue = Annotated[Queue | None, Depends(dep_queue)]
+
+
+def dep_dedupe(res: DepResources) -> Dedupe:
+    return res.dedupe
+
+
+DepDedupe = Annotated[Dedupe, Depends(dep_dedupe)]
+
+
+async def dep_writer(res: DepResources):
+    # buffered events are written before the request ends
+    writer = res.writer
+    try:
+        yield writer
+    finally:
+        await writer.flush()
 
 
-DepStore = Annotated[Store, Depends(dep_store)]
+DepWriter = Annotated[db.WhatsAppWriter, Depends(dep_writer)]
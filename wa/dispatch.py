@@ -0,0 +1,97 @@
+import asyncio
+import contextlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, get_args
+
+import wa.metrics as metrics
+import wa.whats.models as models
+
+logger = logging.getLogger(__name__)
+
+
+MESSAGE_TYPES = frozenset(
+    i.model_fields["type"].default for i in get_args(get_args(models.MessageObject)[0])
+)
+"""Discriminator values of `MessageObject`"""
+
+Admit = Callable[[], contextlib.AbstractAsyncContextManager]
+"""Enters a slot shared by every route, see `wa.admission.Admission.slot`"""
+
+
+@dataclass
+class Route:
+    """A message handler, limited to `limit` concurrent runs of `timeout` seconds.
+
+    Coalescing routes receive the burst of texts, see `wa.coalesce`, instead of
+    a single message.
+    """
+
+    type: str
+    fn: Callable[..., Awaitable[Any]]
+    limit: int
+    timeout: float
+    coalesce: bool = False
+    semaphore: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.semaphore = asyncio.Semaphore(self.limit)
+
+    async def __call__(
+        self,
+        handler: Any,
+        arg: Any,
+        admit: Admit = contextlib.nullcontext,
+    ) -> Any:
+        """Runs the handler once one of its `limit` runs is free, and only then
+        enters `admit`, e.g. a slot of the global admission, so messages waiting
+        on their own limit never hold it"""
+        start = time.perf_counter()
+        async with self.semaphore:
+            wait = time.perf_counter() - start
+            metrics.histogram("dispatch.wait", type=self.type).observe(wait)
+
+            async with admit():
+                metrics.gauge("dispatch.active", type=self.type).inc()
+                try:
+                    async with asyncio.timeout(self.timeout):
+                        latency = metrics.histogram("dispatch.latency", type=self.type)
+                        with latency.time():
+                            return await self.fn(handler, arg)
+                except TimeoutError:
+                    logger.error("%s timed out after %ss", self.type, self.timeout)
+                    metrics.counter("dispatch.timeout", type=self.type).inc()
+                    raise
+                finally:
+                    metrics.gauge("dispatch.active", type=self.type).dec()
+
+
+@dataclass
+class Registry:
+    """Maps `MessageObject` types to their handlers"""
+
+    routes: dict[str, Route] = field(default_factory=dict)
+
+    def register(self, type: str, *, limit: int, timeout: float, coalesce=False):
+        assert type in MESSAGE_TYPES, f"Unknown message type: {type}"
+        assert type not in self.routes, f"Handler already registered: {type}"
+
+        def decorator[F: Callable[..., Awaitable[Any]]](fn: F) -> F:
+            self.routes[type] = Route(
+                type=type,
+                fn=fn,
+                limit=limit,
+                timeout=timeout,
+                coalesce=coalesce,
+            )
+            return fn
+
+        return decorator
+
+    def get(self, msg: models.MessageObject) -> Route | None:
+        route = self.routes.get(msg.type)
+        if route is None:
+            logger.info("get(%s): no handler for %s", msg.id, msg.type)
+            metrics.counter("dispatch.rejected", type=msg.type).inc()
+        return route
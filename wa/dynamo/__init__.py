@@ -1,10 +1,25 @@
 from wa.config import Config
 
-from .messages import Message, MessageDocument, MessageImage, MessageText
+from . import aio, messages
+from .messages import (
+    Message,
+    MessageDocument,
+    MessageImage,
+    MessageText,
+)
 from .tools import Tool, ToolLog, ToolTodo, ToolTodoItem
-from .whatsapp import WhatsAppItem, WhatsAppMessage, WhatsAppStatus
+from .whatsapp import (
+    WhatsAppClaim,
+    WhatsAppDone,
+    WhatsAppItem,
+    WhatsAppMessage,
+    WhatsAppStatus,
+    WhatsAppWriter,
+)
 
 __all__ = [
+    "aio",
+    "messages",
     "Message",
     "MessageDocument",
     "MessageImage",
@@ -13,9 +28,12 @@ __all__ = [
     "ToolLog",
     "ToolTodo",
     "ToolTodoItem",
+    "WhatsAppClaim",
+    "WhatsAppDone",
     "WhatsAppItem",
     "WhatsAppMessage",
     "WhatsAppStatus",
+    "WhatsAppWriter",
 ]
 
 
@@ -24,7 +42,20 @@ def init(cfg: Config):
     WhatsAppItem.Meta.table_name = cfg.DYNAMO_DB_TABLE_EVENTS
     Tool.Meta.table_name = cfg.DYNAMO_DB_TABLE_TOOLS
 
-    if cfg.AWS_ENDPOINT_URL:
-        Message.Meta.host = cfg.AWS_ENDPOINT_URL
-        WhatsAppItem.Meta.host = cfg.AWS_ENDPOINT_URL
-        Tool.Meta.host = cfg.AWS_ENDPOINT_URL
+    for model in (Message, WhatsAppItem, Tool):
+        model.Meta.max_pool_connections = cfg.DYNAMO_DB_MAX_CONNECTIONS
+        if cfg.AWS_ENDPOINT_URL:
+            model.Meta.host = cfg.AWS_ENDPOINT_URL
+
+    aio.init(
+        cfg.AWS_ENDPOINT_URL,
+        max_connections=cfg.DYNAMO_DB_MAX_CONNECTIONS,
+        native=cfg.DYNAMO_DB_NATIVE,
+        queue=cfg.DYNAMO_DB_QUEUE,
+    )
+    messages.cache(
+        size=cfg.HISTORY_CACHE_SIZE,
+        capacity=cfg.HISTORY_CACHE_BYTES,
+        ttl=cfg.HISTORY_CACHE_TTL,
+    )
+    messages.encoding(cfg.HISTORY_FORMAT)
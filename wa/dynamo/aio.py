@@ -0,0 +1,417 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterable, Sequence
+
+import httpx
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError
+from botocore.session import get_session
+from pynamodb._util import bin_decode_attr, bin_encode_attr
+from pynamodb.exceptions import DeleteError, GetError, PutError, QueryError
+from pynamodb.expressions.condition import Condition
+from pynamodb.expressions.projection import create_projection_expression
+from pynamodb.models import Model
+
+import wa.metrics as metrics
+from wa.executor import Executor
+
+logger = logging.getLogger(__name__)
+
+RETRY_CODES = frozenset(
+    {
+        "ProvisionedThroughputExceededException",
+        "RequestLimitExceeded",
+        "ThrottlingException",
+        "InternalServerError",
+        "ServiceUnavailable",
+    }
+)
+"""Errors worth retrying, as botocore does"""
+
+ERRORS = {
+    "PutItem": PutError,
+    "GetItem": GetError,
+    "DeleteItem": DeleteError,
+    "Query": QueryError,
+    "BatchWriteItem": PutError,
+}
+"""PynamoDB exception raised for each operation, so callers keep catching
+the same errors as with the synchronous models"""
+
+
+def _expression(
+    kwargs: dict[str, Any], names: dict[str, str], values: dict[str, Any]
+) -> dict[str, Any]:
+    if names:
+        kwargs["ExpressionAttributeNames"] = {v: k for k, v in names.items()}
+    if values:
+        for i in values.values():
+            bin_encode_attr(i)
+        kwargs["ExpressionAttributeValues"] = values
+    return kwargs
+
+
+def _item(item: Model) -> dict[str, Any]:
+    attributes = item.serialize(null_check=True)
+    for i in attributes.values():
+        bin_encode_attr(i)
+    return attributes
+
+
+def _key(cls: type[Model], hash_key: Any, range_key: Any = None) -> dict[str, Any]:
+    hk, rk = cls._serialize_keys(hash_key, range_key)
+    attribute = cls._hash_key_attribute()
+    key = {attribute.attr_name: {attribute.attr_type: hk}}
+    if rk is not None:
+        attribute = cls._range_key_attribute()
+        key[attribute.attr_name] = {attribute.attr_type: rk}
+    return key
+
+
+def _load[T: Model](cls: type[T], data: dict[str, Any]) -> T:
+    for i in data.values():
+        bin_decode_attr(i)
+    return cls.from_raw_data(data)
+
+
+@dataclass
+class Dynamo:
+    """DynamoDB client for asyncio.
+
+    Talks to the DynamoDB JSON API through a shared `httpx` connection pool and
+    signs requests with botocore's SigV4, so no thread is held while a request
+    is in flight. It reads and writes PynamoDB models, keeping their
+    serialization, discriminators and exceptions.
+
+    It relies on PynamoDB internals, which may change in any release, so it is
+    opt-in with `DYNAMO_DB_NATIVE`. Pin PynamoDB when enabling it.
+
+    Metrics:
+    - `dynamo.latency{op}`: duration of each request, retries included
+    - `dynamo.retries{op,reason}`: requests retried
+    - `dynamo.capacity{op}`: consumed capacity units
+    """
+
+    url: str
+    region: str
+    credentials: Credentials
+    client: httpx.AsyncClient
+    slots: asyncio.Semaphore
+    """One per connection, callers wait here rather than in the `httpx` pool,
+    which times out and rescans its whole queue on every release"""
+    retries: int = 3
+    backoff: float = 0.05
+
+    @staticmethod
+    def create(host: str | None = None, max_connections: int = 50) -> "Dynamo":
+        session = get_session()
+        region = session.get_config_variable("region") or "us-east-1"
+        credentials = session.get_credentials()
+        assert credentials is not None, "AWS credentials not found"
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        return Dynamo(
+            url=host or f"https://dynamodb.{region}.amazonaws.com",
+            region=region,
+            credentials=credentials,
+            client=httpx.AsyncClient(limits=limits, timeout=10),
+            slots=asyncio.Semaphore(max_connections),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _sign(self, op: str, body: bytes) -> dict[str, str]:
+        headers = {
+            "Content-Type": "application/x-amz-json-1.0",
+            "X-Amz-Target": f"DynamoDB_20120810.{op}",
+        }
+        request = AWSRequest(method="POST", url=self.url, data=body, headers=headers)
+        credentials = self.credentials.get_frozen_credentials()
+        SigV4Auth(credentials, "dynamodb", self.region).add_auth(request)
+        return dict(request.headers.items())
+
+    async def call(self, op: str, kwargs: dict[str, Any]) -> dict[str, Any]:
+        body = json.dumps(kwargs).encode()
+        start = time.perf_counter()
+        attempt = 0
+
+        try:
+            while True:
+                try:
+                    # signatures expire, sign every attempt
+                    async with self.slots:
+                        response = await self.client.post(
+                            self.url, content=body, headers=self._sign(op, body)
+                        )
+                except httpx.TransportError as e:
+                    if attempt >= self.retries:
+                        raise
+                    reason = type(e).__name__
+                else:
+                    data = response.json() if response.content else {}
+                    if response.is_success:
+                        break
+
+                    # `com.amazonaws.dynamodb.v20120810#ConditionalCheckFailedException`
+                    *_, reason = data.get("__type", "").split("#")
+                    if reason not in RETRY_CODES and response.status_code < 500:
+                        break
+                    if attempt >= self.retries:
+                        break
+
+                metrics.counter("dynamo.retries", op=op, reason=reason).inc()
+                delay = random.uniform(0, self.backoff * 2**attempt)
+                logger.debug("call(%s): %s, retrying in %.3fs", op, reason, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            took = time.perf_counter() - start
+            metrics.histogram("dynamo.latency", op=op).observe(took)
+
+        if not response.is_success:
+            message = data.get("message") or data.get("Message", "")
+            error = {"Error": {"Code": reason, "Message": message}}
+            cause = ClientError(error, op)  # type: ignore
+            raise ERRORS.get(op, PutError)(f"{op} failed: {reason}", cause)
+
+        # a dict for single table operations, a list for batches
+        capacity = data.get("ConsumedCapacity") or []
+        if isinstance(capacity, dict):
+            capacity = [capacity]
+        if capacity:
+            units = sum(i.get("CapacityUnits", 0) for i in capacity)
+            metrics.histogram("dynamo.capacity", op=op).observe(units)
+        return data
+
+    async def put(self, item: Model, condition: Condition | None = None):
+        kwargs: dict[str, Any] = {
+            "TableName": item.Meta.table_name,
+            "Item": _item(item),
+            "ReturnConsumedCapacity": "TOTAL",
+        }
+        names: dict[str, str] = {}
+        values: dict[str, Any] = {}
+        if condition is not None:
+            kwargs["ConditionExpression"] = condition.serialize(names, values)
+        await self.call("PutItem", _expression(kwargs, names, values))
+
+    async def get[T: Model](
+        self, cls: type[T], hash_key: Any, range_key: Any = None
+    ) -> T | None:
+        kwargs = {
+            "TableName": cls.Meta.table_name,
+            "Key": _key(cls, hash_key, range_key),
+            "ReturnConsumedCapacity": "TOTAL",
+        }
+        data = await self.call("GetItem", kwargs)
+        if "Item" not in data:
+            return None
+        return _load(cls, data["Item"])
+
+    async def refresh(self, item: Model):
+        """Same as `Model.refresh`, raises `DoesNotExist` if the item is gone"""
+        cls = type(item)
+        hk = getattr(item, cls._hash_keyname)
+        rk = getattr(item, cls._range_keyname) if cls._range_keyname else None
+
+        stored = await self.get(cls, hk, rk)
+        if stored is None:
+            raise item.DoesNotExist("This item does not exist in the table.")
+        item.deserialize(stored.serialize(null_check=False))
+
+    async def delete(self, item: Model):
+        cls = type(item)
+        hk = getattr(item, cls._hash_keyname)
+        rk = getattr(item, cls._range_keyname) if cls._range_keyname else None
+        kwargs = {
+            "TableName": cls.Meta.table_name,
+            "Key": _key(cls, hk, rk),
+            "ReturnConsumedCapacity": "TOTAL",
+        }
+        await self.call("DeleteItem", kwargs)
+
+    async def describe(self, cls: type[Model]):
+        await self.call("DescribeTable", {"TableName": cls.Meta.table_name})
+
+    async def query[T: Model](
+        self,
+        cls: type[T],
+        hash_key: Any,
+        limit: int | None = None,
+        scan_index_forward: bool | None = None,
+        attributes_to_get: Sequence[str] | None = None,
+        page_size: int | None = None,
+    ) -> AsyncIterator[T]:
+        """Same as `Model.query`, fetching the next page only when the previous
+        one was consumed"""
+        names: dict[str, str] = {}
+        values: dict[str, Any] = {}
+
+        condition: Condition = cls._hash_key_attribute() == hash_key
+        kwargs: dict[str, Any] = {
+            "TableName": cls.Meta.table_name,
+            "KeyConditionExpression": condition.serialize(names, values),
+            "ReturnConsumedCapacity": "TOTAL",
+        }
+
+        # like PynamoDB, subclasses only see their own items
+        discriminator = cls._get_discriminator_attribute()
+        if discriminator is not None:
+            subclasses = discriminator.get_registered_subclasses(cls)
+            condition = discriminator.is_in(*subclasses)
+            kwargs["FilterExpression"] = condition.serialize(names, values)
+        if attributes_to_get:
+            projection = create_projection_expression(attributes_to_get, names)
+            kwargs["ProjectionExpression"] = projection
+        if scan_index_forward is not None:
+            kwargs["ScanIndexForward"] = scan_index_forward
+        if page_size or limit:
+            kwargs["Limit"] = page_size or limit
+        _expression(kwargs, names, values)
+
+        count = 0
+        while True:
+            data = await self.call("Query", dict(kwargs))
+            for raw in data.get("Items", []):
+                yield _load(cls, raw)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+            last = data.get("LastEvaluatedKey")
+            if not last:
+                return
+            kwargs["ExclusiveStartKey"] = last
+
+    async def batch_write(self, items: Iterable[Model]):
+        """Puts items 25 at a time, retrying unprocessed ones"""
+        requests: dict[str, list] = {}
+        for item in items:
+            put = {"PutRequest": {"Item": _item(item)}}
+            requests.setdefault(item.Meta.table_name, []).append(put)
+
+        pending = [(t, r) for t, rs in requests.items() for r in rs]
+        attempt = 0
+        while pending:
+            batch, pending = pending[:25], pending[25:]
+            tables: dict[str, list] = {}
+            for table, request in batch:
+                tables.setdefault(table, []).append(request)
+
+            kwargs = {"RequestItems": tables, "ReturnConsumedCapacity": "TOTAL"}
+            data = await self.call("BatchWriteItem", kwargs)
+            unprocessed = data.get("UnprocessedItems") or {}
+            if not unprocessed:
+                attempt = 0
+                continue
+
+            if attempt >= self.retries:
+                raise PutError(f"BatchWriteItem left unprocessed: {unprocessed}")
+            attempt += 1
+            pending = [(t, r) for t, rs in unprocessed.items() for r in rs] + pending
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+
+@dataclass
+class Threaded:
+    """Same interface as `Dynamo`, running the synchronous PynamoDB models in
+    `executor`. The default, `Dynamo` is opt-in with `DYNAMO_DB_NATIVE`"""
+
+    executor: Executor
+
+    async def aclose(self):
+        self.executor.shutdown()
+
+    async def put(self, item: Model, condition: Condition | None = None):
+        await self.executor.run(item.save, condition=condition)
+
+    async def get[T: Model](
+        self, cls: type[T], hash_key: Any, range_key: Any = None
+    ) -> T | None:
+        try:
+            return await self.executor.run(cls.get, hash_key, range_key)
+        except cls.DoesNotExist:
+            return None
+
+    async def refresh(self, item: Model):
+        await self.executor.run(item.refresh)
+
+    async def delete(self, item: Model):
+        await self.executor.run(item.delete)
+
+    async def describe(self, cls: type[Model]):
+        await self.executor.run(cls.describe_table)
+
+    async def query[T: Model](
+        self,
+        cls: type[T],
+        hash_key: Any,
+        limit: int | None = None,
+        scan_index_forward: bool | None = None,
+        attributes_to_get: Sequence[str] | None = None,
+        page_size: int | None = None,
+    ) -> AsyncIterator[T]:
+        # lazy, each page is fetched by the `next` call that reaches it
+        results = cls.query(
+            hash_key,
+            limit=limit,
+            scan_index_forward=scan_index_forward,
+            attributes_to_get=attributes_to_get,
+            page_size=page_size,
+        )
+        while (item := await self.executor.run(next, results, None)) is not None:
+            yield item
+
+    async def batch_write(self, items: Iterable[Model]):
+        tables: dict[str, list[Model]] = {}
+        for item in items:
+            tables.setdefault(item.Meta.table_name, []).append(item)
+
+        def write():
+            for batch in tables.values():
+                with type(batch[0]).batch_write() as writer:
+                    for item in batch:
+                        writer.save(item)
+
+        await self.executor.run(write)
+
+
+_client: Dynamo | Threaded | None = None
+
+
+def init(
+    host: str | None = None,
+    max_connections: int = 50,
+    native: bool = False,
+    queue: int = 64,
+):
+    global _client
+    if native:
+        _client = Dynamo.create(host, max_connections)
+    else:
+        _client = Threaded(Executor("dynamo", workers=max_connections, queue=queue))
+
+
+def client() -> Dynamo | Threaded:
+    """The shared client, created by `wa.dynamo.init`"""
+    if _client is None:
+        init()
+    assert _client is not None
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
@@ -1,14 +1,25 @@
-import asyncio
+import dataclasses
 import datetime as dt
+import functools
 import itertools
-from typing import Any
+import json
+import zlib
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Literal
 
 from pydantic import TypeAdapter
-from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse
 from pynamodb import attributes as attr
 from pynamodb.models import MetaProtocol, Model
 
+import wa.metrics as metrics
 import wa.whats.models as models
+from wa.cache import Cache
+
+from . import aio
+
+if TYPE_CHECKING:
+    from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse
 
 
 def _now() -> dt.datetime:
@@ -16,8 +27,179 @@ def _now() -> dt.datetime:
     return dt.datetime.now(dt.UTC)
 
 
-ModelRequestAdapter = TypeAdapter(ModelRequest)
-ModelResponseAdapter = TypeAdapter(ModelResponse)
+@functools.cache
+def _adapters() -> "tuple[TypeAdapter[ModelRequest], TypeAdapter[ModelResponse]]":
+    """pydantic-ai is only imported once agent messages are read or written"""
+    from pydantic_ai.messages import ModelRequest, ModelResponse
+
+    return TypeAdapter(ModelRequest), TypeAdapter(ModelResponse)
+
+
+@functools.cache
+def _zstd() -> ModuleType | None:
+    """`zstandard` is optional, history is compressed with zlib without it"""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+"""First bytes of a zstd frame, anything else is zlib"""
+
+
+def _compress(raw: bytes) -> bytes:
+    zstd = _zstd()
+    if zstd is None:
+        return zlib.compress(raw)
+    return zstd.ZstdCompressor(level=3).compress(raw)
+
+
+def _decompress(data: bytes) -> bytes:
+    if not data.startswith(ZSTD_MAGIC):
+        return zlib.decompress(data)
+    zstd = _zstd()
+    if zstd is None:
+        raise RuntimeError("History is compressed with zstd, install `zstandard`")
+    return zstd.ZstdDecompressor().decompress(data)
+
+
+@dataclass
+class History:
+    """Deserialized messages of a sender's latest items, newest first.
+    `complete` when the table has no items older than these"""
+
+    limit: int
+    complete: bool
+    items: "list[tuple[dt.datetime, list[ModelMessage], int]]" = field(
+        default_factory=list
+    )
+
+    @property
+    def size(self) -> int:
+        """Approximate bytes, as JSON"""
+        return sum(size for *_, size in self.items)
+
+    def messages(self, limit: int) -> "list[ModelMessage] | None":
+        if len(self.items) < limit and not self.complete:
+            return None
+        return [j for _, i, _ in self.items[:limit] for j in i]
+
+    def add(self, timestamp: dt.datetime, messages: "list[ModelMessage]", size: int):
+        # a retried save replaces its item, as it does in the table
+        self.items = [i for i in self.items if i[0] != timestamp]
+        self.items.append((timestamp, messages, size))
+        self.items.sort(key=lambda i: i[0], reverse=True)
+        if len(self.items) > self.limit:
+            del self.items[self.limit :]
+            self.complete = False
+
+
+histories: "Cache[tuple[type[Message], str], History]" = Cache(
+    "history", weigh=lambda i: i.size
+)
+"""Per sender and message type, as `Message.alatest` only queries its own type"""
+
+_ttl: float = 300
+_format: Literal["map", "binary"] = "map"
+
+
+def cache(size: int, capacity: int, ttl: float):
+    """Sizes `histories`. The `ttl` bounds how stale a history gets when another
+    process writes to the same conversation, `0` disables the cache"""
+    global _ttl
+    histories.size = size
+    histories.capacity = capacity
+    _ttl = ttl
+
+
+CHARS_PER_TOKEN = 4
+"""Rough ratio for English text and JSON, close enough to budget a prompt"""
+
+PRUNE_OVER = 200
+"""Tool arguments and returns longer than this many characters are pruned"""
+
+PAGE_SIZE = 10
+"""Items read per query by `Message.arecent`"""
+
+
+def _text(part: Any) -> str:
+    from pydantic_ai.messages import ToolCallPart, ToolReturnPart
+
+    if isinstance(part, ToolCallPart):
+        return part.args_as_json_str()
+    if isinstance(part, ToolReturnPart):
+        return part.model_response_str()
+    content = getattr(part, "content", "")
+    return content if isinstance(content, str) else json.dumps(content, default=str)
+
+
+def _tokens(messages: "list[ModelMessage]") -> int:
+    chars = sum(len(_text(j)) for i in messages for j in i.parts)
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def _prune(messages: "list[ModelMessage]") -> "list[ModelMessage]":
+    """Replaces long tool arguments and returns with a note of their size. The
+    calls and returns themselves are kept, as models expect them in pairs.
+    Returns copies, the messages may be cached"""
+    from pydantic_ai.messages import ToolCallPart, ToolReturnPart
+
+    pruned: list[ModelMessage] = []
+    for message in messages:
+        parts: list[Any] = []
+        for part in message.parts:
+            text = _text(part)
+            note = f"[{len(text)} characters omitted]"
+            if len(text) <= PRUNE_OVER:
+                parts.append(part)
+            elif isinstance(part, ToolCallPart):
+                parts.append(dataclasses.replace(part, args={"omitted": note}))
+            elif isinstance(part, ToolReturnPart):
+                parts.append(dataclasses.replace(part, content=note))
+            else:
+                parts.append(part)
+        pruned.append(dataclasses.replace(message, parts=parts))  # type: ignore
+    return pruned
+
+
+@dataclass
+class Window:
+    """Latest messages of a history within a token budget, oldest first"""
+
+    messages: "list[ModelMessage]"
+    tokens: int
+    pruned: int
+    """Tokens saved by pruning"""
+    filled: bool
+    """The budget was filled before running out of items"""
+
+
+def _fit(history: History, tokens: int, prune: bool) -> Window:
+    """The latest item is always included, and never pruned"""
+    picked: list[list[ModelMessage]] = []
+    used = saved = 0
+    filled = False
+    for _, messages, _ in history.items:
+        full = cost = _tokens(messages)
+        if prune and picked:
+            messages = _prune(messages)
+            cost = _tokens(messages)
+        if picked and used + cost > tokens:
+            filled = True
+            break
+        picked.append(messages)
+        used += cost
+        saved += full - cost
+    messages = [j for i in reversed(picked) for j in i]
+    return Window(messages=messages, tokens=used, pruned=saved, filled=filled)
+
+
+def encoding(format: Literal["map", "binary"]):
+    """How `Message.model_messages` is written. Items are read in either"""
+    global _format
+    _format = format
 
 
 class Message(Model):
@@ -28,10 +210,21 @@ class Message(Model):
     timestamp = attr.UTCDateTimeAttribute(range_key=True, default=_now)
     data = attr.MapAttribute[str, Any](default=dict)
     agent = attr.MapAttribute[str, Any](default=dict)
+    history = attr.BinaryAttribute(null=True, legacy_encoding=False)
+    """The agent messages as compressed JSON, instead of `agent["messages"]`"""
     type = attr.DiscriminatorAttribute()
 
-    @property
-    def model_messages(self) -> list[ModelMessage]:
+    def _decode(self) -> "tuple[list[ModelMessage], int] | None":
+        """The agent messages and their size as JSON, if any were stored"""
+        if self.history is not None:
+            from pydantic_ai.messages import ModelMessagesTypeAdapter
+
+            raw = _decompress(self.history)
+            return ModelMessagesTypeAdapter.validate_json(raw), len(raw)
+        if "messages" not in self.agent:
+            return None
+
+        ModelRequestAdapter, ModelResponseAdapter = _adapters()
         messages: list[ModelMessage] = []
         for i in self.agent["messages"]:
             if i["kind"] == "response":
@@ -40,10 +233,32 @@ class Message(Model):
                 messages.append(ModelRequestAdapter.validate_python(i))
             else:
                 raise ValueError(f"Unknown message kind: {i['kind']}")
+        size = len(json.dumps(self.agent["messages"], default=str))
+        return messages, size
+
+    @property
+    def model_messages(self) -> "list[ModelMessage]":
+        decoded = self._decode()
+        if decoded is None:
+            raise KeyError("messages")
+        messages, _ = decoded
         return messages
 
     @model_messages.setter
-    def model_messages(self, data: list[ModelMessage]):
+    def model_messages(self, data: "list[ModelMessage]"):
+        if _format == "binary":
+            from pydantic_ai.messages import ModelMessagesTypeAdapter
+
+            raw = ModelMessagesTypeAdapter.dump_json(data)
+            self.history = _compress(raw)
+            agent = self.agent.as_dict()
+            agent.pop("messages", None)
+            self.agent = agent
+            # kept for the history cache, so saving does not validate them again
+            self._decoded = (list(data), len(raw))
+            return
+
+        ModelRequestAdapter, ModelResponseAdapter = _adapters()
         messages: list[dict[str, Any]] = []
         for i in data:
             if i.kind == "response":
@@ -55,19 +270,119 @@ class Message(Model):
             else:
                 raise ValueError(f"Unknown message kind: {i.kind}")
         self.agent["messages"] = messages
+        self.history = None
+        self._decoded = (list(data), len(json.dumps(messages, default=str)))
 
-    def latest(self, limit: int = 10) -> list[ModelMessage]:
-        query = self.query(hash_key=self.from_, limit=limit, scan_index_forward=False)
+    @classmethod
+    def _projection(cls) -> list[str]:
+        """Attributes the agent needs, leaving out the raw WhatsApp `data`"""
+        attributes = (cls.from_, cls.timestamp, cls.agent, cls.history, cls.type)
+        return [i.attr_name for i in attributes]
+
+    def latest(self, limit: int = 10) -> "list[ModelMessage]":
+        query = self.query(
+            hash_key=self.from_,
+            limit=limit,
+            scan_index_forward=False,
+            attributes_to_get=self._projection(),
+        )
         messages = itertools.chain.from_iterable(i.model_messages for i in query)
         return list(messages)
 
-    async def alatest(self, limit: int = 10) -> list[ModelMessage]:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.latest, limit)
+    async def alatest(self, limit: int = 10) -> "list[ModelMessage]":
+        """Same as `latest`, but served from `histories` for warm conversations"""
+        cls, key = type(self), (type(self), self.from_)
+
+        async def load() -> tuple[History, float]:
+            query = aio.client().query(
+                cls,
+                self.from_,
+                limit=limit,
+                scan_index_forward=False,
+                attributes_to_get=cls._projection(),
+            )
+            history = History(limit=limit, complete=True)
+            async for i in query:
+                messages, size = i._decode() or ([], 0)
+                history.items.append((i.timestamp, messages, size))
+            history.complete = len(history.items) < limit
+            return history, _ttl
+
+        cached = histories.get(key)
+        if cached is not None and cached.messages(limit) is None:
+            histories.pop(key)
+
+        history = await histories.load(key, load)
+        messages = history.messages(limit)
+        if messages is None:
+            # joined a load of fewer items
+            messages = history.messages(len(history.items)) or []
+        return messages
+
+    async def arecent(self, tokens: int, prune: bool = True) -> "list[ModelMessage]":
+        """Latest messages within about `tokens`, oldest first.
+
+        Items are read newest first, `PAGE_SIZE` at a time, and reading stops
+        once the budget is filled. With `prune`, long tool arguments and returns
+        are replaced by a note in all but the latest item. Served from
+        `histories` when it holds enough items.
+
+        Metrics:
+        - `history.tokens`: estimated tokens returned
+        - `history.pruned`: estimated tokens saved by pruning
+        """
+        cls, key = type(self), (type(self), self.from_)
+
+        async def load() -> tuple[History, float]:
+            query = aio.client().query(
+                cls,
+                self.from_,
+                scan_index_forward=False,
+                attributes_to_get=cls._projection(),
+                page_size=PAGE_SIZE,
+            )
+            history = History(limit=0, complete=True)
+            used = 0
+            async for i in query:
+                messages, size = i._decode() or ([], 0)
+                # cached as stored, pruning is redone by `_fit`
+                counted = _prune(messages) if prune and history.items else messages
+                used += _tokens(counted)
+                history.items.append((i.timestamp, messages, size))
+                # one item over the budget shows it is filled
+                if len(history.items) > 1 and used > tokens:
+                    history.complete = False
+                    break
+            # room for the items saved next, before the oldest are dropped
+            history.limit = len(history.items) + PAGE_SIZE
+            return history, _ttl
+
+        cached = histories.get(key)
+        if cached is not None:
+            window = _fit(cached, tokens, prune)
+            if not window.filled and not cached.complete:
+                histories.pop(key)
+
+        history = await histories.load(key, load)
+        window = _fit(history, tokens, prune)
+        metrics.histogram("history.tokens").observe(window.tokens)
+        metrics.counter("history.pruned").inc(window.pruned)
+        return window.messages
 
     async def asave(self):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.save)
+        await aio.client().put(self)
+
+        key = (type(self), self.from_)
+        history = histories.get(key)
+        if history is None:
+            return
+
+        decoded = getattr(self, "_decoded", None) or self._decode()
+        if decoded is None:
+            histories.pop(key)
+            return
+        history.add(self.timestamp, *decoded)
+        histories.put(key, history, _ttl)
 
 
 class MessageText(Message, discriminator="wa:message:text"):
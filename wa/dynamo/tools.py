@@ -1,4 +1,3 @@
-import asyncio
 import datetime as dt
 import logging
 from typing import Any, Self
@@ -7,6 +6,8 @@ from pynamodb import attributes as attr
 from pynamodb.exceptions import DoesNotExist
 from pynamodb.models import MetaProtocol, Model
 
+from . import aio
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,8 +29,7 @@ class Tool(Model):
         raise NotImplementedError("Subclass must implement this method")
 
     async def asave(self):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.save)
+        await aio.client().put(self)
 
     @classmethod
     def fetch(cls, id: str) -> Self:
@@ -43,12 +43,15 @@ class Tool(Model):
 
     @classmethod
     async def afetch(cls, id: str) -> Self:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, cls.fetch, id)
+        item = await aio.client().get(cls, id, cls.NAME)
+        if item is not None:
+            return item
+        item = cls(id=id, tool=cls.NAME)
+        await item.asave()
+        return item
 
     async def arefresh(self):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.refresh)
+        await aio.client().refresh(self)
 
 
 class ToolTodoItem(attr.MapAttribute):
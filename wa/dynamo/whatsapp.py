@@ -1,12 +1,19 @@
 import asyncio
 import datetime as dt
+import logging
+from dataclasses import dataclass, field
 from typing import Any
 
 from pynamodb import attributes as attr
+from pynamodb.exceptions import PutError
 from pynamodb.models import MetaProtocol, Model
 
 import wa.whats.models as models
 
+from . import aio
+
+logger = logging.getLogger(__name__)
+
 
 def _now() -> dt.datetime:
     """Utility function to get the current UTC time."""
@@ -24,8 +31,7 @@ class WhatsAppItem(Model):
     type = attr.DiscriminatorAttribute()
 
     async def asave(self):
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.save)
+        await aio.client().put(self)
 
 
 class WhatsAppMessage(WhatsAppItem, discriminator="whatsapp:item:message"):
@@ -44,3 +50,93 @@ class WhatsAppStatus(WhatsAppItem, discriminator="whatsapp:item:status"):
     def from_model(model: models.StatusObject) -> "WhatsAppStatus":
         data = model.model_dump(mode="json")
         return WhatsAppStatus(key=model.id, timestamp=model.timestamp, data=data)
+
+
+class WhatsAppClaim(WhatsAppItem, discriminator="whatsapp:item:claim"):
+    """Marks a WhatsApp id as processed. Saved only if it does not exist yet,
+    deleted if processing fails so a redelivery is processed again"""
+
+    id = attr.UnicodeAttribute(hash_key=True, default="whatsapp:item:claim")
+    ttl = attr.TTLAttribute(default=dt.timedelta(days=7))
+
+    async def aclaim(self) -> bool:
+        try:
+            condition = WhatsAppClaim.key.does_not_exist()
+            await aio.client().put(self, condition=condition)
+            return True
+        except PutError as e:
+            if e.cause_response_code == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    async def arelease(self):
+        await aio.client().delete(self)
+
+
+class WhatsAppDone(WhatsAppItem, discriminator="whatsapp:item:done"):
+    """Marks a queued WhatsApp message as processed, so a redelivery of its SQS
+    record, e.g. in a batch that timed out, is not processed again"""
+
+    id = attr.UnicodeAttribute(hash_key=True, default="whatsapp:item:done")
+    ttl = attr.TTLAttribute(default=dt.timedelta(days=7))
+
+    async def adone(self) -> bool:
+        return await aio.client().get(WhatsAppDone, self.id, self.key) is not None
+
+
+@dataclass
+class WhatsAppWriter:
+    """Write-behind buffer for WhatsApp items.
+
+    Items are written with BatchWriteItem, which takes up to 25 items, when the
+    buffer is full, when the oldest item waited `age` seconds or on `flush`.
+    A batch can't hold two items with the same key, e.g. the statuses of a
+    message, so only the last one is written. Unprocessed items are retried by
+    the client. Items of a write that failed on the network or throttling go
+    back to the buffer for the next one, other failures drop them.
+    """
+
+    size: int = 25
+    age: float = 1.0
+    items: list[WhatsAppItem] = field(default_factory=list, repr=False)
+    timer: asyncio.Task | None = field(default=None, repr=False)
+
+    async def put(self, item: WhatsAppItem):
+        self.items.append(item)
+        if len(self.items) >= self.size:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._expire(), name="expire")
+
+    async def flush(self):
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        self.timer = None
+
+        items, self.items = self.items, []
+        if not items:
+            return
+
+        # the last item of each key, e.g. a `read` status over `delivered`
+        items = list({(i.id, i.key): i for i in items}.values())
+
+        logger.info("flush(): %s items", len(items))
+        try:
+            await aio.client().batch_write(items)
+        except PutError as e:
+            if e.cause_response_code not in (None, *aio.RETRY_CODES):
+                logger.error("flush(): dropping %s items: %s", len(items), e)
+                return
+            # ahead of the items put while writing
+            self.items[:0] = items
+            raise
+        except BaseException:
+            self.items[:0] = items
+            raise
+
+    async def _expire(self):
+        await asyncio.sleep(self.age)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush items")
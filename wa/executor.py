@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+import wa.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Executor:
+    """Named thread pool for blocking calls, such as boto3's.
+
+    At most `workers` calls run at once and `queue` more wait for a thread.
+    Callers past that wait in `run` before submitting anything, so a burst
+    holds back whoever produces it instead of piling up in the pool's unbounded
+    queue.
+
+    Metrics:
+    - `executor.active{executor}`: calls running in a thread
+    - `executor.queued{executor}`: calls submitted and waiting for a thread
+    - `executor.blocked{executor}`: callers waiting to submit, the pool is full
+    - `executor.wait{executor}`: seconds between submitting a call and its start
+    - `executor.latency{executor}`: seconds a call ran in its thread
+    """
+
+    name: str
+    workers: int = 8
+    queue: int = 64
+    inflight: int = 0
+    blocked: int = 0
+    pool: ThreadPoolExecutor = field(init=False, repr=False)
+    slots: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+        self.slots = asyncio.Semaphore(self.workers + self.queue)
+
+    def _gauges(self):
+        # the pool is FIFO, so only the oldest `workers` calls are running
+        active = min(self.inflight, self.workers)
+        metrics.gauge("executor.active", executor=self.name).set(active)
+        metrics.gauge("executor.queued", executor=self.name).set(self.inflight - active)
+        metrics.gauge("executor.blocked", executor=self.name).set(self.blocked)
+
+    async def _acquire(self):
+        if not self.slots.locked():
+            await self.slots.acquire()
+            return
+
+        logger.debug("run(%s): pool is full, waiting", self.name)
+        self.blocked += 1
+        self._gauges()
+        try:
+            await self.slots.acquire()
+        finally:
+            self.blocked -= 1
+
+    async def run[T](self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Runs `fn` in the pool, waiting first if it is full"""
+        await self._acquire()
+
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        times: list[float] = []
+
+        def call() -> T:
+            times.append(time.perf_counter())
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter())
+
+        def done():
+            # the slot is only freed when the thread is, even if the caller
+            # was cancelled in the meantime
+            self.inflight -= 1
+            self.slots.release()
+            self._gauges()
+            if times:
+                started, finished = times
+                wait = started - submitted
+                metrics.histogram("executor.wait", executor=self.name).observe(wait)
+                took = finished - started
+                metrics.histogram("executor.latency", executor=self.name).observe(took)
+
+        future: Future[T] = self.pool.submit(call)
+        self.inflight += 1
+        self._gauges()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(done))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import wa.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Lane:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    depth: int = 0
+
+
+@dataclass
+class Lanes:
+    """Runs work with the same key (the sender) strictly in arrival order, while
+    different keys run in parallel. How many run at once is up to the work, e.g.
+    agent runs take a slot of `Admission`, which sheds what it cannot take.
+
+    Metrics, not labelled by key as keys are phone numbers:
+    - `lanes.lanes`: keys with queued or running work
+    - `lanes.depth`: queued and running work of every lane
+    - `lanes.wait`: how long work waited for the previous work of its lane
+    - `lanes.active`: work currently running
+    """
+
+    lanes: dict[str, Lane] = field(default_factory=dict, repr=False)
+
+    async def run[T](self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        lane = self.lanes.setdefault(key, Lane())
+        lane.depth += 1
+        metrics.gauge("lanes.lanes").set(len(self.lanes))
+        metrics.gauge("lanes.depth").inc()
+
+        start = time.perf_counter()
+        try:
+            async with lane.lock:
+                wait = time.perf_counter() - start
+                logger.debug("run(%s): waited %.3fs", key, wait)
+                metrics.histogram("lanes.wait").observe(wait)
+
+                metrics.gauge("lanes.active").inc()
+                try:
+                    return await fn()
+                finally:
+                    metrics.gauge("lanes.active").dec()
+        finally:
+            lane.depth -= 1
+            metrics.gauge("lanes.depth").dec()
+            if lane.depth == 0:
+                del self.lanes[key]
+                metrics.gauge("lanes.lanes").set(len(self.lanes))
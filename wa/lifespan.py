@@ -1,4 +1,6 @@
+import asyncio
 import contextlib
+import functools
 import logging
 from typing import AsyncGenerator
 
@@ -6,20 +8,44 @@ from fastapi import FastAPI
 
 import wa.dynamo
 import wa.logs
+import wa.warm
 from wa.config import Config
+from wa.resources import Resources
 
 logger = logging.getLogger(__name__)
 
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    from wa.routes import make_handler, process
+
     logger.info("Starting server...")
 
     cfg = Config()  # type: ignore
     wa.logs.init()
     wa.dynamo.init(cfg)
 
+    res = app.state.resources = Resources.create(cfg)
+    # in the background, starting does not wait for the connections. Lambda
+    # warms up during its init instead, see `handler.py`
+    warming = None
+    if cfg.WARM_UP and getattr(app.state, "warm_in_background", True):
+        warm = wa.warm.warm(res, cfg.WARM_UP_BUDGET, wa.warm.STARTUP)
+        warming = asyncio.create_task(warm, name="warm")
+
+    if res.queue is not None:
+        handler = make_handler(res)
+        await res.queue.start(functools.partial(process, handler))
+
     logger.info("Finished starting server")
     yield  # server runs
     logger.info("Shutting down server")
+
+    if warming is not None:
+        warming.cancel()
+        await asyncio.gather(warming, return_exceptions=True)
+    if res.queue is not None:
+        await res.queue.stop()
+    await res.aclose()
+
     logger.info("Finished shutting down server")
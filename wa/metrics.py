@@ -0,0 +1,112 @@
+"""In-process metrics, exposed by `GET /metrics` when `METRICS_TOKEN` is set"""
+
+import contextlib
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclass
+class Counter:
+    value: float = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dump(self) -> dict[str, Any]:
+        return {"value": self.value}
+
+
+@dataclass
+class Gauge:
+    value: float = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def dump(self) -> dict[str, Any]:
+        return {"value": self.value}
+
+
+@dataclass
+class Histogram:
+    """Keeps the totals and the latest samples to estimate percentiles"""
+
+    count: int = 0
+    sum: float = 0
+    max: float = 0
+    samples: deque[float] = field(default_factory=lambda: deque(maxlen=1024))
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def dump(self) -> dict[str, Any]:
+        data: dict[str, Any] = {"count": self.count, "sum": self.sum, "max": self.max}
+        if len(self.samples) > 1:
+            q = statistics.quantiles(self.samples, n=100, method="inclusive")
+            data.update(p50=q[49], p90=q[89], p99=q[98])
+        return data
+
+
+Metric = Counter | Gauge | Histogram
+
+
+@dataclass
+class Registry:
+    metrics: dict[tuple[str, Labels], Metric] = field(default_factory=dict)
+
+    def _get[T: Metric](self, kind: type[T], name: str, labels: dict[str, str]) -> T:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            metric = self.metrics[key] = kind()
+        assert isinstance(metric, kind), f"{name} is not a {kind.__name__}"
+        return metric
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels: str) -> Gauge:
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        return self._get(Histogram, name, labels)
+
+    def dump(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "name": name,
+                "type": type(metric).__name__.lower(),
+                "labels": dict(labels),
+                **metric.dump(),
+            }
+            for (name, labels), metric in sorted(self.metrics.items())
+        ]
+
+
+registry = Registry()
+
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
@@ -0,0 +1,137 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import wa.metrics as metrics
+import wa.whats.text as text
+from wa.whats.client import WhatsApp
+
+logger = logging.getLogger(__name__)
+
+REPLY = 0
+REACT = 1
+SEND = 2
+"""Priorities, lower goes first: answers to users beat reactions, which beat
+messages nobody is waiting for"""
+
+
+@dataclass
+class Bucket:
+    """Token bucket handing out `rate` tokens per second, up to `burst` at once.
+
+    Callers without a token wait in a priority queue and are released one by
+    one as tokens refill, so bursts are paced instead of rejected.
+    """
+
+    rate: float
+    burst: float
+    tokens: float = field(init=False)
+    updated: float = field(init=False)
+    waiters: list[tuple[int, int, asyncio.Future]] = field(default_factory=list)
+    counter: itertools.count = field(default_factory=itertools.count, repr=False)
+    pacer: asyncio.Task | None = field(default=None, repr=False)
+
+    def __post_init__(self):
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, priority: int):
+        self._refill()
+        if not self.waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        # the counter keeps arrival order within the same priority
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if self.pacer is None or self.pacer.done():
+            self.pacer = asyncio.create_task(self._pace(), name="pacer")
+        await future
+
+    async def _pace(self):
+        while self.waiters:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            *_, future = heapq.heappop(self.waiters)
+            # the caller gave up waiting
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+
+
+@dataclass
+class Outbox:
+    """Sends WhatsApp messages through a token bucket per `sender_id`, so
+    bursts stay under Meta's per number throughput.
+
+    Metrics:
+    - `outbox.depth{sender}`: sends waiting for a token
+    - `outbox.wait{op}`: how long sends waited for a token
+    - `outbox.latency{op}`: wait plus the request itself
+    """
+
+    whats: WhatsApp
+    rate: float = 20
+    burst: float = 10
+    buckets: dict[str, Bucket] = field(default_factory=dict, repr=False)
+
+    async def _submit[T](
+        self, op: str, priority: int, fn: Callable[[], Awaitable[T]]
+    ) -> T:
+        sender = self.whats.sender_id
+        bucket = self.buckets.get(sender)
+        if bucket is None:
+            bucket = self.buckets[sender] = Bucket(rate=self.rate, burst=self.burst)
+
+        start = time.perf_counter()
+        depth = metrics.gauge("outbox.depth", sender=sender)
+        depth.inc()
+        try:
+            await bucket.take(priority)
+        finally:
+            depth.dec()
+        wait = time.perf_counter() - start
+        logger.debug("%s(): waited %.3fs", op, wait)
+        metrics.histogram("outbox.wait", op=op).observe(wait)
+
+        try:
+            return await fn()
+        finally:
+            took = time.perf_counter() - start
+            metrics.histogram("outbox.latency", op=op).observe(took)
+
+    async def send(self, to: str, message: str) -> list[Any]:
+        """Sends as many messages as needed to fit WhatsApp's text limit. Each
+        one is sent once the previous one was accepted, so they arrive in order"""
+        results = []
+        for body in text.chunks(message):
+            fn = functools.partial(self.whats.send, to, body)
+            results.append(await self._submit("send", SEND, fn))
+        return results
+
+    async def reply(self, to: str, id: str, message: str) -> list[Any]:
+        """Same as `send`, with every message quoting the message `id`"""
+        results = []
+        for body in text.chunks(message):
+            fn = functools.partial(self.whats.reply, to, id, body)
+            results.append(await self._submit("reply", REPLY, fn))
+        return results
+
+    async def react(self, to: str, id: str, reaction: str) -> Any:
+        return await self._submit(
+            "react", REACT, lambda: self.whats.react(to, id, reaction)
+        )
@@ -0,0 +1,261 @@
+import asyncio
+import functools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Protocol
+
+from botocore.client import BaseClient
+from fastapi import FastAPI
+
+import wa.dynamo as db
+import wa.whats.models as models
+from wa.config import Config
+from wa.executor import Executor
+
+logger = logging.getLogger(__name__)
+
+Process = Callable[[models.MessageObject], Awaitable[Any]]
+
+
+class Queue(Protocol):
+    @property
+    def ordered(self) -> bool:
+        """Whether the messages of a sender are consumed in order. Shed messages
+        of an ordered queue can't be put back behind the following ones"""
+        ...
+
+    async def put(self, msg: models.MessageObject, delay: float = 0) -> None: ...
+
+    async def start(self, process: Process) -> None: ...
+
+    async def stop(self) -> None: ...
+
+
+def _dump(msg: models.MessageObject) -> str:
+    # `from_` is only accepted through its alias when validating
+    return models.MessageObjectAdapter.dump_json(msg, by_alias=True).decode()
+
+
+def _load(body: str | bytes) -> models.MessageObject:
+    return models.MessageObjectAdapter.validate_json(body)
+
+
+@dataclass
+class LocalQueue:
+    """In-process queue consumed by asyncio worker tasks.
+
+    Only meant for the long-running server. Lambda freezes the process between
+    invocations, so use `SQSQueue` there.
+    """
+
+    workers: int = 4
+    ordered: bool = False
+    queue: asyncio.Queue[models.MessageObject] = field(default_factory=asyncio.Queue)
+    tasks: list[asyncio.Task] = field(default_factory=list, repr=False)
+
+    async def put(self, msg: models.MessageObject, delay: float = 0) -> None:
+        logger.info("put(%s): %s", msg.id, msg.type)
+        if delay <= 0:
+            await self.queue.put(msg)
+            return
+
+        loop = asyncio.get_event_loop()
+        loop.call_later(delay, self.queue.put_nowait, msg)
+
+    async def start(self, process: Process) -> None:
+        logger.info("start(): %s workers", self.workers)
+        for i in range(self.workers):
+            task = asyncio.create_task(self._work(process), name=f"worker-{i}")
+            self.tasks.append(task)
+
+    async def stop(self) -> None:
+        logger.info("stop(): %s pending", self.queue.qsize())
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    async def _work(self, process: Process) -> None:
+        while True:
+            msg = await self.queue.get()
+            try:
+                await process(msg)
+            except Exception:
+                logger.exception("Failed to process message %s", msg.id)
+            finally:
+                self.queue.task_done()
+
+
+@dataclass
+class SQSQueue:
+    """Queue backed by SQS.
+
+    In AWS the messages are consumed by the Lambda SQS event source, see
+    `handler.py` and `consume`. Locally, point `AWS_ENDPOINT_URL` to localstack
+    and set `QUEUE_SQS_POLL` so this process polls the queue itself.
+
+    A FIFO queue (its name ends in `.fifo`) is consumed in order per sender and
+    drops duplicated ids. It can't delay single messages, so a failed message
+    is retried, with the ones after it, when its visibility timeout expires. A
+    standard queue does not keep any order.
+    """
+
+    client: BaseClient
+    url: str
+    poll: bool = False
+    executor: Executor = field(default_factory=lambda: Executor("sqs", workers=4))
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def ordered(self) -> bool:
+        return self.url.endswith(".fifo")
+
+    async def put(self, msg: models.MessageObject, delay: float = 0) -> None:
+        logger.info("put(%s): %s", msg.id, msg.type)
+        kwargs: dict[str, Any] = {"QueueUrl": self.url, "MessageBody": _dump(msg)}
+        if self.ordered:
+            kwargs["MessageGroupId"] = msg.from_
+            kwargs["MessageDeduplicationId"] = msg.id
+        else:
+            # maximum allowed by SQS is 15 minutes
+            kwargs["DelaySeconds"] = min(int(delay), 900)
+        await self.executor.run(self.client.send_message, **kwargs)
+
+    async def start(self, process: Process) -> None:
+        if not self.poll:
+            return
+        logger.info("start(): polling %s", self.url)
+        self.task = asyncio.create_task(self._poll(process), name="poller")
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.executor.shutdown()
+
+    async def _poll(self, process: Process) -> None:
+        receive = functools.partial(
+            self.client.receive_message,
+            QueueUrl=self.url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=20,
+            MessageSystemAttributeNames=["MessageGroupId"],
+        )
+
+        while True:
+            try:
+                response = await self.executor.run(receive)
+            except Exception:
+                logger.exception("Failed to receive messages")
+                await asyncio.sleep(5)
+                continue
+
+            records = [
+                {
+                    "messageId": i["MessageId"],
+                    "body": i["Body"],
+                    "attributes": i.get("Attributes", {}),
+                }
+                for i in response.get("Messages", [])
+            ]
+            failures = await self.consume(records, process)
+            failed = {i["itemIdentifier"] for i in failures}
+
+            for i in response.get("Messages", []):
+                if i["MessageId"] in failed:
+                    continue
+                await self.executor.run(
+                    self.client.delete_message,
+                    QueueUrl=self.url,
+                    ReceiptHandle=i["ReceiptHandle"],
+                )
+
+    @staticmethod
+    async def consume(records: list[dict], process: Process) -> list[dict[str, str]]:
+        """Process SQS records and return the ones that failed, in the format
+        expected by Lambda partial batch responses.
+
+        Records of a FIFO group (a sender) run one after the other. Once one
+        fails, the rest of its group is returned unprocessed, to keep the order.
+        Processed messages are marked in DynamoDB and skipped when redelivered,
+        e.g. when the invocation timed out after processing some of them.
+        """
+        failures: list[dict[str, str]] = []
+        groups: dict[str, list[dict]] = {}
+        for record in records:
+            attributes = record.get("attributes") or {}
+            group = attributes.get("MessageGroupId") or record["messageId"]
+            groups.setdefault(group, []).append(record)
+
+        async def one(group: list[dict]):
+            for n, record in enumerate(group):
+                msg = _load(record["body"])
+                done = db.WhatsAppDone(key=msg.id)
+                try:
+                    if await done.adone():
+                        logger.info("consume(%s): already processed", msg.id)
+                        continue
+                    await process(msg)
+                except Exception:
+                    logger.exception("Failed to process record %s", record["messageId"])
+                    failures.extend(
+                        {"itemIdentifier": i["messageId"]} for i in group[n:]
+                    )
+                    return
+
+                try:
+                    await done.asave()
+                except Exception:
+                    # processing it again beats failing a processed record
+                    logger.exception("consume(%s): failed to mark processed", msg.id)
+
+        async with asyncio.TaskGroup() as tg:
+            for group in groups.values():
+                tg.create_task(one(group), name="consume")
+
+        return failures
+
+
+def create(cfg: Config) -> Queue | None:
+    if cfg.WEBHOOK_QUEUE is None:
+        return None
+
+    if cfg.WEBHOOK_QUEUE == "asyncio":
+        logger.info("Using asyncio queue")
+        return LocalQueue(workers=cfg.QUEUE_WORKERS)
+
+    import boto3
+    from botocore.config import Config as BotoConfig
+
+    assert cfg.AWS_SQS_QUEUE_URL, "AWS_SQS_QUEUE_URL is required for SQS queue"
+    logger.info("Using SQS queue: %s", cfg.AWS_SQS_QUEUE_URL)
+    client = boto3.client(
+        "sqs",
+        endpoint_url=cfg.AWS_ENDPOINT_URL,
+        config=BotoConfig(max_pool_connections=cfg.SQS_WORKERS),
+    )
+    return SQSQueue(
+        client=client,
+        url=cfg.AWS_SQS_QUEUE_URL,
+        poll=cfg.QUEUE_SQS_POLL,
+        executor=Executor("sqs", workers=cfg.SQS_WORKERS, queue=cfg.SQS_QUEUE),
+    )
+
+
+def is_sqs_event(event: dict) -> bool:
+    records = event.get("Records") or [{}]
+    return records[0].get("eventSource") == "aws:sqs"
+
+
+async def consume(app: FastAPI, event: dict) -> dict[str, list[dict[str, str]]]:
+    """Entrypoint for the Lambda SQS event source. Expects the app to be
+    started already, see `handler.py`"""
+    from wa.routes import make_handler, process
+
+    handler = make_handler(app.state.resources)
+    run = functools.partial(process, handler)
+    failures = await SQSQueue.consume(event["Records"], run)
+
+    return {"batchItemFailures": failures}
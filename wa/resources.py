@@ -0,0 +1,148 @@
+import functools
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import wa.dynamo as db
+import wa.queue
+from wa.admission import Admission
+from wa.blob import Store
+from wa.coalesce import Coalescer
+from wa.config import Config
+from wa.dedupe import Dedupe
+from wa.executor import Executor
+from wa.lanes import Lanes
+from wa.outbox import Outbox
+from wa.queue import Queue
+from wa.whats.client import Transport, WhatsApp
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from pydantic_ai.models import Model
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Resources:
+    """Everything that lives as long as the process: configuration, clients and
+    their connection pools, and the state shared between requests.
+
+    Built once by `wa.lifespan.lifespan` and kept in `app.state.resources`. The
+    LLM model and the S3 store are slow to import or build and not needed by
+    every request, so they are only built on first use.
+    """
+
+    config: Config
+    whats: WhatsApp
+    outbox: Outbox
+    queue: Queue | None
+    writer: db.WhatsAppWriter
+    dedupe: Dedupe
+    lanes: Lanes
+    admission: Admission
+    coalescer: Coalescer
+    openai: "AsyncOpenAI | None" = field(default=None, init=False, repr=False)
+
+    @functools.cached_property
+    def model(self) -> "Model":
+        self.openai, model = _model(self.config)
+        return model
+
+    @functools.cached_property
+    def store(self) -> Store:
+        import boto3
+        from botocore.config import Config as BotoConfig
+
+        cfg = self.config
+        s3 = boto3.resource(
+            "s3",
+            endpoint_url=cfg.AWS_ENDPOINT_URL,
+            config=BotoConfig(max_pool_connections=cfg.S3_WORKERS),
+        )
+        return Store(
+            bucket=s3.Bucket(cfg.AWS_S3_BUCKET_RAG),
+            executor=Executor("s3", workers=cfg.S3_WORKERS, queue=cfg.S3_QUEUE),
+        )
+
+    @staticmethod
+    def create(cfg: Config) -> "Resources":
+        whats = WhatsApp(
+            access_token=cfg.WHATSAPP_ACCESS_TOKEN,
+            sender_id=cfg.WHATSAPP_SENDER_ID,
+            base_url=cfg.WHATSAPP_BASE_URL,
+            verify_token=cfg.WHATSAPP_VERIFY_TOKEN,
+            transport=Transport(
+                http2=cfg.WHATSAPP_HTTP2,
+                max_connections=cfg.WHATSAPP_MAX_CONNECTIONS,
+                timeouts={
+                    "send": cfg.WHATSAPP_TIMEOUT,
+                    "reply": cfg.WHATSAPP_TIMEOUT,
+                    "react": cfg.WHATSAPP_TIMEOUT,
+                    "media": cfg.WHATSAPP_TIMEOUT_MEDIA,
+                },
+                retries=cfg.WHATSAPP_RETRIES,
+            ),
+        )
+
+        return Resources(
+            config=cfg,
+            whats=whats,
+            outbox=Outbox(whats=whats, rate=cfg.OUTBOX_RATE, burst=cfg.OUTBOX_BURST),
+            queue=wa.queue.create(cfg),
+            writer=db.WhatsAppWriter(
+                size=cfg.DYNAMO_DB_BATCH_SIZE,
+                age=cfg.DYNAMO_DB_BATCH_AGE,
+            ),
+            dedupe=Dedupe(size=cfg.DEDUPE_SIZE),
+            lanes=Lanes(),
+            admission=Admission(
+                limit=cfg.ADMISSION_LIMIT,
+                queue=cfg.ADMISSION_QUEUE,
+                timeout=cfg.ADMISSION_TIMEOUT,
+            ),
+            coalescer=Coalescer(
+                window=cfg.COALESCE_WINDOW,
+                limit=cfg.COALESCE_LIMIT,
+            ),
+        )
+
+    async def aclose(self):
+        logger.info("aclose(): closing clients")
+        await self.writer.flush()
+        await db.aio.aclose()
+        await self.whats.client.aclose()
+        if self.openai is not None:
+            await self.openai.close()
+        if "store" in self.__dict__:
+            self.store.bucket.meta.client.close()
+            self.store.executor.shutdown()
+
+
+def _model(cfg: Config) -> "tuple[AsyncOpenAI | None, Model]":
+    from openai import AsyncOpenAI
+    from pydantic_ai.models.gemini import GeminiModel
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.google_gla import GoogleGLAProvider
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    if cfg.GEMINI_API_KEY:
+        logger.info("Using Gemini model")
+        # the provider uses pydantic-ai's cached, shared http client
+        model = GeminiModel(
+            model_name="gemini-2.0-flash",
+            provider=GoogleGLAProvider(api_key=cfg.GEMINI_API_KEY),
+        )
+        return None, model
+
+    logger.info("Using OpenAI model")
+    openai = AsyncOpenAI(
+        api_key=cfg.OPENAI_API_KEY,
+        base_url=cfg.OPENAI_BASE_URL,
+        default_headers={"Helicone-Auth": f"Bearer {cfg.HELICONE_API_KEY}"},
+    )
+    model = OpenAIModel(
+        model_name="gpt-4o-mini",
+        provider=OpenAIProvider(openai_client=openai),
+    )
+    return openai, model
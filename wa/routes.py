@@ -1,20 +1,37 @@
 import asyncio
+import datetime as dt
+import itertools
 import logging
+import secrets
 from dataclasses import dataclass
-from typing import Annotated
+from typing import TYPE_CHECKING, Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic_ai import Agent
-from pydantic_ai.messages import DocumentUrl, ImageUrl, UserContent
-from pydantic_ai.models import Model
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 
+import wa.blob as blob
 import wa.deps as deps
 import wa.dynamo as db
+import wa.metrics as metrics
 import wa.whats.models as models
-from wa.agents import State
+from wa.admission import Admission, Busy
 from wa.blob import Store
+from wa.coalesce import Coalescer
+from wa.dispatch import Registry
+from wa.lanes import Lanes
+from wa.outbox import Outbox
+from wa.queue import Queue
+from wa.resources import Resources
 from wa.whats.client import WhatsApp
 
+# the LLM stack is only imported when a message is processed, so webhook
+# verification and status deliveries do not pay for it on a cold start
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ModelMessage
+    from pydantic_ai.models import Model
+
+    from wa.agents import State
+
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
@@ -41,95 +58,211 @@ async def subscribe(ctx: _GetContext) -> int:
     return ctx.hub_challenge
 
 
+@dataclass
+class MetricsContext:
+    config: deps.DepConfig
+    authorization: Annotated[str, Header()] = ""
+
+
+_MetricsContext = Annotated[MetricsContext, Depends()]
+
+
+@router.get("/metrics")
+async def get_metrics(ctx: _MetricsContext) -> list[dict]:
+    token = ctx.config.METRICS_TOKEN
+    if token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    bearer = ctx.authorization.removeprefix("Bearer ")
+    if not secrets.compare_digest(bearer.encode(), token.encode()):
+        logger.warning("Invalid metrics token")
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return metrics.registry.dump()
+
+
+registry = Registry()
+
+
 @dataclass
 class Handler:
-    agent: Agent[State, str]
-    model: Model
+    res: Resources
     whats: WhatsApp
-    store: Store
+    outbox: Outbox
+    lanes: Lanes
+    coalescer: Coalescer
+    writer: db.WhatsAppWriter
+    admission: Admission
+    queue: Queue | None
+    defer: float
+
+    BUSY = "I am a bit busy right now, please try again in a few minutes."
+
+    @property
+    def agent(self) -> "Agent[State, str]":
+        from wa.agents import agent
+
+        return agent
+
+    @property
+    def model(self) -> "Model":
+        return self.res.model
+
+    @property
+    def store(self) -> Store:
+        return self.res.store
+
+    async def download(
+        self, user: str, id: str, sha256: str | None, mime: str, suffix: str
+    ) -> str:
+        """Stores a media once per content and aliases it for the user. Returns
+        the key of the blob.
+
+        The download is skipped when a blob with the same hash exists. Media
+        without a hash in the webhook is looked up first to get one.
+        """
+        digest = blob.digest(sha256)
+        if digest is None:
+            info = await self.whats.lookup(id)
+            digest = blob.digest(info.sha256)
+
+        if digest is None or not await self.store.exists(digest):
+            async with self.whats.stream(id) as response:
+                upload = await self.store.put(response.aiter_bytes(), mime, digest)
+            digest = upload.sha256
+
+        key = "/".join(["whatsapp", "user", user, "media", id])
+        await self.store.alias(f"{key}.{suffix}", digest, mime)
+        return self.store.key(digest)
+
+    async def history(self, message: db.Message) -> "list[ModelMessage]":
+        cfg = self.res.config
+        return await message.arecent(cfg.HISTORY_TOKENS, prune=cfg.HISTORY_PRUNE_TOOLS)
 
     async def on_message(self, data: models.MessageObject) -> db.WhatsAppMessage:
         logger.info("on_message(%s): %s", data.id, data.type)
         logger.debug("%s", data.model_dump_json())
         item = db.WhatsAppMessage.from_model(data)
-        await item.asave()
+        await self.writer.put(item)
         return item
 
     async def on_status(self, data: models.StatusObject) -> db.WhatsAppStatus:
         logger.info("on_status(%s): %s", data.id, data.status)
         logger.debug("%s", data.model_dump_json())
         item = db.WhatsAppStatus.from_model(data)
-        await item.asave()
+        await self.writer.put(item)
         return item
 
     async def on_text(self, data: models.TextMessage):
-        logger.info("on_text(%s): %s", data.id, data.text)
-        logger.debug("%s", data.model_dump_json())
+        return await self.on_texts([data])
 
-        message = db.MessageText.from_model(data)
+    async def on_busy(self, burst: list[models.MessageObject]):
+        """Retries shed messages later when there is a queue, otherwise asks the
+        sender to try again. An ordered queue retries them itself, as they fail"""
+        *_, data = burst
+        logger.info("on_busy(%s): %s messages", data.id, len(burst))
+
+        if self.queue is None:
+            await self.outbox.reply(data.from_, data.id, self.BUSY)
+            return
+        if self.queue.ordered:
+            raise Busy(f"shed {data.id}")
+
+        async with asyncio.TaskGroup() as tg:
+            for i in burst:
+                tg.create_task(self.queue.put(i, delay=self.defer))
+
+    @registry.register("text", limit=16, timeout=45, coalesce=True)
+    async def on_texts(self, burst: list[models.TextMessage]):
+        """Answers a burst of texts from the same sender with a single run. Every
+        text is stored, but only the last one holds the agent messages"""
+        *_, data = burst
+        logger.info("on_texts(%s): %s texts", data.id, len(burst))
+        for i in burst:
+            logger.info("on_text(%s): %s", i.id, i.text)
+            logger.debug("%s", i.model_dump_json())
+
+        items = [db.MessageText.from_model(i) for i in burst]
+        # the timestamp is the range key and WhatsApp's has seconds, which the
+        # texts of a burst often share
+        for previous, item in itertools.pairwise(items):
+            if item.timestamp <= previous.timestamp:
+                item.timestamp = previous.timestamp + dt.timedelta(microseconds=1)
+        *earlier, message = items
 
         async with asyncio.TaskGroup() as tg:
             tg.create_task(
-                self.whats.react(
+                self.outbox.react(
                     data.from_,
                     data.id,
                     self.whats.EMOJI_THINKING,
                 )
             )
 
-            history = await tg.create_task(message.alatest())
+            history = await tg.create_task(self.history(message))
 
         tool_todo = await db.ToolTodo.afetch(data.from_)
         tool_log = await db.ToolLog.afetch(data.from_)
         logger.info(f"{tool_todo.data=}")
         logger.info(f"{tool_log.data=}")
 
+        from wa.agents import State
+
         context = State(todo=tool_todo, log=tool_log)
 
         result = await self.agent.run(
-            user_prompt=message.body,
+            user_prompt="\n".join(i.body for i in items),
             message_history=history,
             deps=context,
             model=self.model,
         )
         message.model_messages = result.new_messages()
+        for i in earlier:
+            i.model_messages = []
 
         for msg in result.new_messages():
             for part in msg.parts:
                 logger.info("part: %s", part)
 
+        async def save():
+            # in order, the history is cached as each item is written
+            for i in items:
+                await i.asave()
+
         async with asyncio.TaskGroup() as tg:
-            tg.create_task(message.asave())
-            tg.create_task(self.whats.reply(data.from_, data.id, result.data))
+            tg.create_task(save())
+            tg.create_task(self.outbox.reply(data.from_, data.id, result.data))
 
         return result
 
+    @registry.register("image", limit=4, timeout=50)
     async def on_image(self, data: models.ImageMessage):
         logger.info("on_image(%s): %s", data.id, data.image.sha256)
         logger.debug("%s", data.model_dump_json())
 
         message = db.MessageImage.from_model(data)
 
-        async with asyncio.TaskGroup() as tg:
-            t_media = tg.create_task(self.whats.media(data.image.id))
-            t_history = tg.create_task(message.alatest())
-
-        media = await t_media
-        history = await t_history
-
         *_, suffix = data.image.mime_type.split("/")
         assert suffix, f"Invalid mime type: {data.image.mime_type}"
 
-        key = "/".join(["whatsapp", "user", data.from_, "media", data.image.id])
-        key = f"{key}.{suffix}"
-
         async with asyncio.TaskGroup() as tg:
-            tg.create_task(self.store.save(key, media, data.image.mime_type))
-            url = await tg.create_task(self.store.presigned(key))
+            t_key = tg.create_task(
+                self.download(
+                    data.from_,
+                    data.image.id,
+                    data.image.sha256,
+                    data.image.mime_type,
+                    suffix,
+                )
+            )
+            t_history = tg.create_task(self.history(message))
+
+        history = await t_history
+        url = await self.store.presigned(await t_key)
 
         REPLACE_HOST = "f3da984dfb9f82e8dba931477dccdd3d.serveo.net"
         url = url.replace("localhost:4566", REPLACE_HOST)
 
+        from pydantic_ai.messages import ImageUrl, UserContent
+
         prompt: list[UserContent] = [ImageUrl(url=url)]
         if data.image.caption:
             prompt.append(data.image.caption)
@@ -143,32 +276,34 @@ class Handler:
 
         async with asyncio.TaskGroup() as tg:
             tg.create_task(message.asave())
-            tg.create_task(self.whats.reply(data.from_, data.id, result.data))
+            tg.create_task(self.outbox.reply(data.from_, data.id, result.data))
 
         return result
 
+    @registry.register("document", limit=4, timeout=50)
     async def on_document(self, data: models.DocumentMessage):
         logger.info("on_document(%s): %s", data.id, data.document.id)
         logger.debug("%s", data.model_dump_json())
 
         message = db.MessageDocument.from_model(data)
 
-        async with asyncio.TaskGroup() as tg:
-            t_media = tg.create_task(self.whats.media(data.document.id))
-            t_history = tg.create_task(message.alatest())
-
-        media = await t_media
-        history = await t_history
-
         *_, suffix = data.document.mime_type.split("/")
         assert suffix, f"Invalid mime type: {data.document.mime_type}"
 
-        key = "/".join(["whatsapp", "user", data.from_, "media", data.document.id])
-        key = f"{key}.{suffix}"
-
         async with asyncio.TaskGroup() as tg:
-            tg.create_task(self.store.save(key, media, data.document.mime_type))
-            url = await tg.create_task(self.store.presigned(key))
+            t_key = tg.create_task(
+                self.download(
+                    data.from_,
+                    data.document.id,
+                    data.document.sha256,
+                    data.document.mime_type,
+                    suffix,
+                )
+            )
+            t_history = tg.create_task(self.history(message))
+
+        history = await t_history
+        url = await self.store.presigned(await t_key)
 
         # stop here as it does not work with openai
         # return
@@ -176,6 +311,8 @@ class Handler:
         REPLACE_HOST = "f3da984dfb9f82e8dba931477dccdd3d.serveo.net"
         url = url.replace("localhost:4566", REPLACE_HOST)
 
+        from pydantic_ai.messages import DocumentUrl
+
         prompt: list[DocumentUrl | str] = [DocumentUrl(url=url)]
         if data.document.caption:
             prompt.append(data.document.caption)
@@ -190,54 +327,110 @@ class Handler:
 
         async with asyncio.TaskGroup() as tg:
             tg.create_task(message.asave())
-            tg.create_task(self.whats.reply(data.from_, data.id, result.data))
+            tg.create_task(self.outbox.reply(data.from_, data.id, result.data))
 
         return result
 
 
-def dep_handler(
-    agent: deps.DepAgent,
-    model: deps.DepModel,
-    whats: deps.DepWhatsApp,
-    store: deps.DepStore,
-) -> Handler:
-    return Handler(agent=agent, model=model, whats=whats, store=store)
+def make_handler(res: Resources) -> Handler:
+    return Handler(
+        res=res,
+        whats=res.whats,
+        outbox=res.outbox,
+        lanes=res.lanes,
+        coalescer=res.coalescer,
+        writer=res.writer,
+        admission=res.admission,
+        queue=res.queue,
+        defer=res.config.ADMISSION_DEFER,
+    )
+
+
+def dep_handler(res: deps.DepResources, _: deps.DepWriter) -> Handler:
+    # `DepWriter` writes the buffered events when the request ends
+    return make_handler(res)
 
 
 DepHandler = Annotated[Handler, Depends(dep_handler)]
 
 
+async def process(handler: Handler, msg: models.MessageObject):
+    route = registry.get(msg)
+    if route is None:
+        return
+
+    async def run(arg: Any):
+        async def admitted():
+            return await route(handler, arg, handler.admission.slot)
+
+        # messages of the same sender run one after the other, in order, then
+        # wait for their type's limit and only then for a global slot, so
+        # neither the lanes nor a busy type hold back admission
+        try:
+            return await handler.lanes.run(msg.from_, admitted)
+        except Busy:
+            await handler.on_busy(arg if isinstance(arg, list) else [arg])
+
+    # texts sent in quick succession are answered together
+    if route.coalesce:
+        return await handler.coalescer.submit(msg, run)
+    return await run(msg)
+
+
 @dataclass
 class PostContext:
     handler: DepHandler
     data: deps.DepWebhook
     config: deps.DepConfig
+    queue: deps.DepQueue
+    dedupe: deps.DepDedupe
 
 
 _PostContext = Annotated[PostContext, Depends()]
 
 
+async def handle(ctx: PostContext, msg: models.MessageObject):
+    """Processes a message before responding, or enqueues it to be processed
+    after. Releases its claim if that fails, as WhatsApp will redeliver it"""
+    try:
+        if ctx.queue is None:
+            await process(ctx.handler, msg)
+        elif registry.get(msg) is not None:
+            await ctx.queue.put(msg)
+    except BaseException:
+        await ctx.dedupe.release(msg)
+        raise
+
+
 @router.post("/")
 async def receive(ctx: _PostContext) -> dict[str, bool]:
     for entry in ctx.data.entry:
         logger.info("receive(%s)", entry.id)
         logger.debug("%s", entry.model_dump_json())
 
+    # drop redeliveries before doing any work
+    received = ctx.data.messages()
+    claims = await asyncio.gather(
+        *(ctx.dedupe.message(msg) for msg in received), return_exceptions=True
+    )
+    errors = [i for i in claims if isinstance(i, BaseException)]
+    if errors:
+        # WhatsApp redelivers them all, the claims held would drop them
+        claimed = [m for m, c in zip(received, claims, strict=True) if c is True]
+        await asyncio.gather(*(ctx.dedupe.release(msg) for msg in claimed))
+        raise errors[0]
+    messages = [msg for msg, claimed in zip(received, claims) if claimed]
+    statuses = [sts for sts in ctx.data.statuses() if ctx.dedupe.status(sts)]
+
     async with asyncio.TaskGroup() as tg:
         # store whatsapp messages
-        for msg in ctx.data.messages():
+        for msg in messages:
             tg.create_task(ctx.handler.on_message(msg), name="on_message")
         # store whatsapp statuses
-        for sts in ctx.data.statuses():
+        for sts in statuses:
             tg.create_task(ctx.handler.on_status(sts), name="on_status")
 
-        # process messages
-        for msg in ctx.data.messages():
-            if msg.type == "image":
-                tg.create_task(ctx.handler.on_image(msg), name="on_image")
-            if msg.type == "text":
-                tg.create_task(ctx.handler.on_text(msg), name="on_text")
-            if msg.type == "document":
-                tg.create_task(ctx.handler.on_document(msg), name="on_document")
+        for msg in messages:
+            tg.create_task(handle(ctx, msg), name=f"on_{msg.type}")
 
     return {"success": True}
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable
+
+import wa.dynamo as db
+import wa.metrics as metrics
+from wa.resources import Resources
+
+logger = logging.getLogger(__name__)
+
+
+async def _graph(res: Resources):
+    await res.whats.client.head(res.whats.base_url)
+
+
+async def _llm(res: Resources):
+    # building the model imports the LLM stack, which blocks for a while
+    model = await asyncio.to_thread(lambda: res.model)
+    if res.openai is not None:
+        await res.openai.models.list()
+    else:
+        await model.client.head(model.base_url)  # type: ignore
+
+
+async def _dynamo(res: Resources):
+    async with asyncio.TaskGroup() as tg:
+        for model in (db.Message, db.WhatsAppItem, db.Tool):
+            tg.create_task(db.aio.client().describe(model))
+
+
+async def _s3(res: Resources):
+    # as does importing boto3 and creating its client
+    store = await asyncio.to_thread(lambda: res.store)
+    bucket = store.bucket
+    await store.executor.run(bucket.meta.client.head_bucket, Bucket=bucket.name)
+
+
+TARGETS: dict[str, Callable[[Resources], Awaitable[None]]] = {
+    "graph": _graph,
+    "llm": _llm,
+    "dynamo": _dynamo,
+    "s3": _s3,
+}
+
+STARTUP = ("graph",)
+"""Targets warmed in the background when the server starts. The others create
+botocore clients or import the LLM stack, CPU taken from the first requests.
+Lambda warms them all during its init, see `handler.py`"""
+
+
+async def warm(
+    res: Resources, budget: float, targets: Iterable[str] = TARGETS
+) -> dict[str, float]:
+    """Opens the pooled connections of the `targets` concurrently, so the first
+    request does not pay for DNS and TLS. Targets still running after `budget`
+    seconds are cancelled. Returns how long each finished target took.
+
+    Only the connection matters, so the responses and errors are ignored. The
+    blocking imports and client creation run in threads, so requests are served
+    meanwhile.
+    """
+    took: dict[str, float] = {}
+
+    async def one(name: str, fn: Callable[[Resources], Awaitable[None]]):
+        start = time.perf_counter()
+        try:
+            await fn(res)
+        except Exception as e:
+            logger.debug("warm(%s): %s", name, e)
+        took[name] = time.perf_counter() - start
+        metrics.histogram("warm.latency", target=name).observe(took[name])
+
+    tasks = [asyncio.create_task(one(i, TARGETS[i]), name=i) for i in targets]
+    _, pending = await asyncio.wait(tasks, timeout=budget)
+    for task in pending:
+        logger.warning("warm(%s): over budget of %ss", task.get_name(), budget)
+        metrics.counter("warm.timeout", target=task.get_name()).inc()
+        task.cancel()
+
+    logger.info("warm(): %s", {k: f"{v:.3f}s" for k, v in took.items()})
+    return took
+
+
+def is_ping(event: dict) -> bool:
+    """Scheduled EventBridge events sent to keep the connections alive"""
+    return event.get("source") == "aws.events"
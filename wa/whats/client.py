@@ -1,21 +1,104 @@
+import asyncio
 import contextlib
 import hashlib
 import hmac
+import json
 import logging
+import random
 import secrets
+import time
 from dataclasses import dataclass, field
-from tempfile import SpooledTemporaryFile
-from typing import IO, Final
+from typing import AsyncIterator, Final
+from urllib.parse import parse_qs, urlsplit
 
 import httpx
 from httpx import AsyncClient
 
+import wa.metrics as metrics
+import wa.whats.models as models
+from wa.cache import Cache
+
 logger = logging.getLogger(__name__)
 
 
 OLD_NUM_LENGTH = 12
 """Old brazilian numbers used to have 12 digits, now they have 13"""
 
+MEDIA_URL_TTL = 300
+"""Seconds a media url is valid for, according to Meta"""
+
+MEDIA_URL_MARGIN = 30
+"""Seconds before expiring that a cached media url is dropped"""
+
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+"""Transient statuses worth retrying. Anything else is a bad request."""
+
+IDEMPOTENT = frozenset({"GET", "HEAD"})
+"""Methods retried on any transient failure. Other requests, e.g. sending a
+message, may have been processed already and are only retried when they were
+rejected (429) or never sent"""
+
+UNSENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+"""Failures before any byte of the request went out"""
+
+
+@dataclass
+class Transport:
+    """How the `WhatsApp` client talks to the Graph API: HTTP version, pool
+    sizes, per-operation timeouts and retry policy"""
+
+    http2: bool = True
+    max_connections: int = 20
+    max_keepalive: int = 10
+    keepalive_expiry: float = 30
+    connect: float = 5
+    timeouts: dict[str, float] = field(
+        default_factory=lambda: {"send": 10, "reply": 10, "react": 5, "media": 60}
+    )
+    retries: int = 3
+    backoff: float = 0.5
+    backoff_max: float = 30
+
+    def timeout(self, op: str) -> httpx.Timeout:
+        return httpx.Timeout(self.timeouts.get(op, 10), connect=self.connect)
+
+    def delay(self, attempt: int, response: httpx.Response | None) -> float:
+        """Seconds to wait before retrying. Follows the rate limit headers sent
+        by Meta when present, otherwise exponential backoff with full jitter"""
+        if response is not None:
+            wait = _retry_after(response.headers)
+            if wait is not None:
+                return wait
+        cap = min(self.backoff_max, self.backoff * 2**attempt)
+        return random.uniform(0, cap)
+
+
+def _retry_after(headers: httpx.Headers) -> float | None:
+    if "retry-after" in headers:
+        with contextlib.suppress(ValueError):
+            return float(headers["retry-after"])
+
+    # `{"<business id>": [{"estimated_time_to_regain_access": <minutes>, ...}]}`
+    usage = headers.get("x-business-use-case-usage")
+    if usage is None:
+        return None
+    try:
+        items = [j for i in json.loads(usage).values() for j in i]
+        minutes = max(i.get("estimated_time_to_regain_access", 0) for i in items)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return minutes * 60 if minutes > 0 else None
+
+
+def _ttl(url: str) -> float:
+    # lookaside urls carry their expiry timestamp in `ext`
+    ttl: float = MEDIA_URL_TTL
+    ext = parse_qs(urlsplit(url).query).get("ext")
+    if ext:
+        with contextlib.suppress(ValueError):
+            ttl = min(ttl, float(ext[0]) - time.time())
+    return ttl - MEDIA_URL_MARGIN
+
 
 @dataclass
 class WhatsApp:
@@ -23,6 +106,10 @@ class WhatsApp:
     sender_id: str
     base_url: Final = "https://graph.facebook.com/v22.0"
     verify_token: str | None = None
+    transport: Transport = field(default_factory=Transport)
+    lookups: Cache[str, models.MediaUrlObject] = field(
+        default_factory=lambda: Cache("media"), repr=False
+    )
 
     client: AsyncClient = field(init=False, repr=False)
 
@@ -30,7 +117,79 @@ class WhatsApp:
 
     def __post_init__(self) -> None:
         headers = {"Authorization": f"Bearer {self.access_token}"}
-        self.client = AsyncClient(base_url=self.base_url, headers=headers)
+        self.client = AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            http2=self.transport.http2,
+            timeout=self.transport.timeout("default"),
+            limits=httpx.Limits(
+                max_connections=self.transport.max_connections,
+                max_keepalive_connections=self.transport.max_keepalive,
+                keepalive_expiry=self.transport.keepalive_expiry,
+            ),
+        )
+
+    async def _request(
+        self, op: str, method: str, url: str, stream: bool = False, **kwargs
+    ) -> httpx.Response:
+        """Sends a request, retrying transient failures, and raises on errors.
+        Only idempotent requests are retried after they may have been processed.
+
+        With `stream` the body is not read, the caller must close the response.
+        """
+        timeout = self.transport.timeout(op)
+        idempotent = method in IDEMPOTENT
+        retry = RETRY_STATUS if idempotent else frozenset({429})
+        attempt = 0
+
+        while True:
+            start = time.perf_counter()
+            response = None
+            try:
+                request = self.client.build_request(
+                    method, url, timeout=timeout, **kwargs
+                )
+                response = await self.client.send(request, stream=stream)
+                reason = str(response.status_code)
+            except httpx.TransportError as e:
+                reason = type(e).__name__
+                if attempt >= self.transport.retries:
+                    raise
+                if not idempotent and not isinstance(e, UNSENT):
+                    raise
+            finally:
+                took = time.perf_counter() - start
+                metrics.histogram("whats.latency", op=op).observe(took)
+
+            logger.debug("%s(%s): %s", op, attempt, reason)
+            if response is not None and response.status_code not in retry:
+                break
+            if attempt >= self.transport.retries:
+                break
+
+            delay = self.transport.delay(attempt, response)
+            if delay > self.transport.backoff_max:
+                logger.warning("%s(): rate limited for %ss, giving up", op, delay)
+                break
+
+            logger.warning("%s(): %s, retrying in %.2fs", op, reason, delay)
+            metrics.counter("whats.retries", op=op, reason=reason).inc()
+            if response is not None:
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        assert response is not None
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError:
+            metrics.counter("whats.errors", op=op, status=reason).inc()
+            await response.aread()
+            await response.aclose()
+            logger.error("%s", response.text)
+            raise
+
+        return response
 
     def _url(self, *args: str) -> str:
         return "/".join([self.base_url, self.sender_id, *args])
@@ -53,7 +212,9 @@ class WhatsApp:
             yield self
 
     async def send(self, to: str, message: str):
-        response = await self.client.post(
+        response = await self._request(
+            "send",
+            "POST",
             url=self._url("messages"),
             json={
                 "messaging_product": "whatsapp",
@@ -65,17 +226,12 @@ class WhatsApp:
         )
 
         logger.debug("%s", response)
-
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.error("%s", response.json())
-            raise
-
         return response.json()
 
     async def reply(self, to: str, id: str, message: str):
-        response = await self.client.post(
+        response = await self._request(
+            "reply",
+            "POST",
             url=self._url("messages"),
             json={
                 "messaging_product": "whatsapp",
@@ -88,44 +244,47 @@ class WhatsApp:
         )
 
         logger.debug("%s", response)
-
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.error("%s", response.json())
-            raise
-
         return response.json()
 
-    async def media(self, id: str) -> IO[bytes]:
-        url = "/".join([self.base_url, id])
+    async def lookup(self, id: str) -> models.MediaUrlObject:
+        """Resolves a media id into its download url, mime type, hash and size.
 
-        try:
-            response = await self.client.get(url)
+        Cached until shortly before the url expires, and concurrent lookups of
+        the same id share one request.
+        """
+
+        async def fetch() -> tuple[models.MediaUrlObject, float]:
+            url = "/".join([self.base_url, id])
+            response = await self._request("media", "GET", url)
             logger.debug(f"{response=}")
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.error("%s", response.json())
-            raise
+            media = models.MediaUrlObject.model_validate_json(response.content)
+            return media, _ttl(media.url)
 
-        body = response.json()
-        url = body["url"]
-        logger.debug(f"{url=}")
+        return await self.lookups.load(id, fetch)
 
-        try:
-            response = await self.client.get(url)
-            logger.debug(f"{response=}")
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.error("%s", response.json())
-            raise
+    @contextlib.asynccontextmanager
+    async def stream(self, id: str) -> AsyncIterator[httpx.Response]:
+        """Downloads a media without reading its body, consume it with
+        `response.aiter_bytes()` inside the context"""
+        media = await self.lookup(id)
+        logger.debug(f"{media.url=}")
 
-        file = SpooledTemporaryFile()
-        async for chunk in response.aiter_bytes():
-            file.write(chunk)
-        file.seek(0)
+        try:
+            response = await self._request("media", "GET", media.url, stream=True)
+        except httpx.HTTPStatusError as e:
+            if not e.response.is_client_error:
+                raise
+            # the cached url was revoked before it expired, look it up again
+            logger.warning("stream(%s): %s, refreshing url", id, e.response)
+            self.lookups.pop(id)
+            media = await self.lookup(id)
+            response = await self._request("media", "GET", media.url, stream=True)
 
-        return file
+        logger.debug(f"{response=}")
+        try:
+            yield response
+        finally:
+            await response.aclose()
 
     @staticmethod
     def verify(secret: str, sig: str, data: bytes) -> bool:
@@ -135,7 +294,9 @@ class WhatsApp:
         return secrets.compare_digest(signature, sig)
 
     async def react(self, to: str, id: str, reaction: str):
-        response = await self.client.post(
+        response = await self._request(
+            "react",
+            "POST",
             url=self._url("messages"),
             json={
                 "messaging_product": "whatsapp",
@@ -146,10 +307,4 @@ class WhatsApp:
             },
         )
 
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError:
-            logger.error("%s", response.json())
-            raise
-
         return response.json()
@@ -1,7 +1,7 @@
 import datetime as dt
 from typing import Annotated, Any, Literal, Union
 
-from pydantic import BaseModel, Field, Tag, TypeAdapter
+from pydantic import BaseModel, Field, TypeAdapter
 
 
 class Metadata(BaseModel):
@@ -39,6 +39,17 @@ class ButtonObject(BaseModel):
     text: str
 
 
+class MediaUrlObject(BaseModel):
+    """Response of the media lookup, `url` expires after 5 minutes"""
+
+    id: str
+    url: str
+    mime_type: str
+    sha256: str | None = None
+    file_size: int | None = None
+    messaging_product: str = "whatsapp"
+
+
 class AudioObject(BaseModel):
     id: str
     mime_type: str
@@ -227,7 +238,8 @@ MessageObject = Annotated[
         LocationMessage,
         UnknownMessage,
     ],
-    Tag("type"),
+    # validates only the member matching `type`, instead of trying each one
+    Field(discriminator="type"),
 ]
 
 MessageObjectAdapter: TypeAdapter[MessageObject] = TypeAdapter(MessageObject)
@@ -309,3 +321,7 @@ class Webhook(BaseModel):
             for change in entry.changes:
                 statuses.extend(change.value.statuses)
         return statuses
+
+
+# schemas are built once, at import, and decode JSON bytes directly
+WebhookAdapter: TypeAdapter[Webhook] = TypeAdapter(Webhook)
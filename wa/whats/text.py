@@ -0,0 +1,99 @@
+import re
+
+LIMIT = 4096
+"""Maximum characters of a WhatsApp text body"""
+
+MARKERS = "*_~"
+"""WhatsApp formatting: *bold*, _italic_ and ~strikethrough~"""
+
+CODE = "```"
+
+_PARAGRAPH = re.compile(r"\n\n")
+_LINE = re.compile(r"\n")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"(?<=\s)")
+
+
+def _pack(pieces: list[str], sep: str, limit: int) -> list[str]:
+    """Joins consecutive pieces while they fit in `limit`"""
+    chunks: list[str] = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + len(sep) + len(piece) <= limit:
+            chunks[-1] += sep + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def _split(text: str, limit: int) -> list[str]:
+    """Splits on paragraphs, then sentences, then words, then anywhere"""
+    if len(text) <= limit:
+        return [text]
+
+    for pattern, sep in (
+        (_PARAGRAPH, "\n\n"),
+        (_LINE, "\n"),
+        (_SENTENCE, " "),
+        (_WORD, ""),
+    ):
+        pieces = pattern.split(text)
+        if len(pieces) > 1:
+            return _pack([j for i in pieces for j in _split(i, limit)], sep, limit)
+
+    return [text[i : i + limit] for i in range(0, len(text), limit)]
+
+
+def _open(text: str) -> list[str]:
+    """Formatting still open at the end of `text`, in the order it was opened"""
+    opened: list[str] = []
+    code = False
+    i = 0
+    while i < len(text):
+        if text.startswith(CODE, i):
+            code = not code
+            i += len(CODE)
+            continue
+
+        c = text[i]
+        if c in MARKERS and not code:
+            before = text[i - 1] if i > 0 else " "
+            after = text[i + 1] if i + 1 < len(text) else " "
+            if c in opened and not before.isspace():
+                # closes everything opened after it as well
+                del opened[opened.index(c) :]
+            elif c not in opened and not after.isspace() and not before.isalnum():
+                opened.append(c)
+        i += 1
+
+    return [CODE] if code else opened
+
+
+def chunks(text: str, limit: int = LIMIT) -> list[str]:
+    """Splits a message into bodies of at most `limit` characters, preferring
+    paragraph and sentence boundaries. Formatting cut in half is closed at the
+    end of a chunk and opened again at the start of the next one."""
+    if len(text) <= limit:
+        return [text]
+
+    # room to close and reopen the formatting around each cut
+    reserve = 2 * max(len(CODE) + 1, len(MARKERS))
+    result: list[str] = []
+    carry: list[str] = []
+    for piece in _split(text, limit - reserve):
+        # the indentation of a code line is content, keep it
+        piece = piece.lstrip("\n").rstrip() if carry == [CODE] else piece.strip()
+        if not piece:
+            continue
+
+        prefix = "".join(carry)
+        if carry == [CODE]:
+            prefix += "\n"
+        body = prefix + piece
+        carry = _open(body)
+
+        suffix = "".join(reversed(carry))
+        if carry == [CODE]:
+            suffix = "\n" + suffix
+        result.append(body + suffix)
+
+    return result